@@ -0,0 +1,185 @@
+"""Micro-benchmarks for the export scanner.
+
+Run from the server directory: ``python bench.py``
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import tempfile
+import time
+import timeit
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import main
+
+_RECORD_TYPES = [
+    ("HKQuantityTypeIdentifierStepCount", lambda r: str(r.randint(1, 400))),
+    ("HKQuantityTypeIdentifierActiveEnergyBurned", lambda r: f"{r.uniform(0.1, 30):.3f}"),
+    ("HKQuantityTypeIdentifierHeartRate", lambda r: str(r.randint(45, 170))),
+    ("HKQuantityTypeIdentifierRestingHeartRate", lambda r: str(r.randint(45, 70))),
+    ("HKCategoryTypeIdentifierSleepAnalysis", lambda r: r.choice(["HKCategoryValueSleepAnalysisInBed", "HKCategoryValueSleepAnalysisAsleepCore", "HKCategoryValueSleepAnalysisAwake"])),
+    ("HKCategoryTypeIdentifierMindfulSession", lambda r: None),
+    # Real exports are dominated by types the wrapped never reads
+    ("HKQuantityTypeIdentifierBasalEnergyBurned", lambda r: f"{r.uniform(0.5, 2):.3f}"),
+    ("HKQuantityTypeIdentifierDistanceWalkingRunning", lambda r: f"{r.uniform(0.001, 0.2):.4f}"),
+    ("HKQuantityTypeIdentifierHeadphoneAudioExposure", lambda r: f"{r.uniform(40, 90):.2f}"),
+    ("HKQuantityTypeIdentifierWalkingSpeed", lambda r: f"{r.uniform(3, 6):.2f}"),
+]
+
+
+def _sample_dates(n: int = 10_000) -> list[str]:
+    rnd = random.Random(0)
+    offsets = ["+0000", "+0100", "+0200", "-0500", "-0700", "+0530"]
+    return [
+        f"{rnd.randint(2015, 2025)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} "
+        f"{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d} {rnd.choice(offsets)}"
+        for _ in range(n)
+    ]
+
+
+# Fixed-width but malformed: strptime rejects every one, so _parse_dt must not decode them
+_MALFORMED_DATES = [
+    " 024-01-01 10:00:00 +0100",
+    "2024-+1-01 10:00:00 +0100",
+    "2024-01-01 10:-1:00 +0100",
+    "2024-01-01 10:00:00 + 100",
+    "2024-01-01 10:00:00 +01_0",
+    "2024-0\u0663-01 10:00:00 +0100",  # non-ASCII digit
+    "2024-13-01 10:00:00 +0100",
+]
+
+
+def bench_dates(repeat: int = 5) -> None:
+    dates = _sample_dates()
+    assert [main._parse_dt(s) for s in dates] == [
+        datetime.strptime(s, "%Y-%m-%d %H:%M:%S %z") for s in dates
+    ]
+    assert [main._parse_dt(s) for s in _MALFORMED_DATES] == [None] * len(_MALFORMED_DATES)
+
+    def strptime() -> None:
+        for s in dates:
+            datetime.strptime(s, "%Y-%m-%d %H:%M:%S %z")
+
+    def fixed_width() -> None:
+        for s in dates:
+            main._parse_dt(s)
+
+    base = min(timeit.repeat(strptime, number=1, repeat=repeat))
+    fast = min(timeit.repeat(fixed_width, number=1, repeat=repeat))
+    per = 1e9 / len(dates)
+    print(f"dates      strptime {base * per:7.0f} ns/date   _parse_dt {fast * per:7.0f} ns/date   {base / fast:.1f}x")
+
+
+def write_synthetic_export(path: str, records: int, seed: int = 0, grouped: bool = False) -> None:
+    # grouped=True lays records out one type after another with workouts last, like
+    # Apple's exporter; otherwise types and workouts are interleaved at random
+    rnd = random.Random(seed)
+    base = datetime(2024, 1, 1)
+    fmt = "%Y-%m-%d %H:%M:%S +0100"
+    runs: list[list[str]] = [[] for _ in range(len(_RECORD_TYPES) + 1)]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<HealthData locale="en_US">\n')
+        f.write(' <ExportDate value="2025-01-01 00:00:00 +0100"/>\n')
+        for i in range(records):
+            k = rnd.randrange(len(_RECORD_TYPES))
+            rtype, value = _RECORD_TYPES[k]
+            start = base + timedelta(seconds=rnd.randint(0, 365 * 86400))
+            end = start + timedelta(seconds=rnd.randint(60, 3600))
+            val = value(rnd)
+            line = (
+                f' <Record type="{rtype}" sourceName="Apple Watch" sourceVersion="10.1" unit="count" '
+                f'creationDate="{end.strftime(fmt)}" startDate="{start.strftime(fmt)}" endDate="{end.strftime(fmt)}"'
+                + (f' value="{val}"' if val is not None else "")
+            )
+            if rtype == "HKCategoryTypeIdentifierSleepAnalysis":
+                # Real sleep records carry their time zone, which apple-health-parser requires
+                line += '>\n  <MetadataEntry key="HKTimeZone" value="Europe/Berlin"/>\n </Record>\n'
+            else:
+                line += "/>\n"
+            (runs[k].append if grouped else f.write)(line)
+            if i % 200 == 0:
+                line = (
+                    f' <Workout workoutActivityType="HKWorkoutActivityTypeRunning" duration="{rnd.uniform(10, 90):.2f}" '
+                    f'durationUnit="min" startDate="{start.strftime(fmt)}" endDate="{end.strftime(fmt)}"/>\n'
+                )
+                (runs[-1].append if grouped else f.write)(line)
+        for run in runs:
+            f.writelines(run)
+        f.write("</HealthData>\n")
+
+
+def bench_scan(records: int = 200_000) -> None:
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "export.xml")
+        write_synthetic_export(path, records)
+
+        backends = ["stdlib", "expat", "fast"] + (["lxml"] if main.LET is not None else [])
+        default = main.XML_BACKEND
+        results = {}
+        try:
+            for backend in backends:
+                main.XML_BACKEND = backend
+                t = time.perf_counter()
+                results[backend] = main._scan_records_once(path)
+                secs = time.perf_counter() - t
+                print(f"scan       {backend:<8} {records / secs:10,.0f} records/s   {secs:6.2f} s")
+        finally:
+            main.XML_BACKEND = default
+        assert all(r == results["stdlib"] for r in results.values())
+
+
+def bench_index(records: int = 200_000) -> None:
+    # Fast scans of a grouped export: without an index, while building it (the workouts-only
+    # index the first query writes is rebuilt for all metrics), and reading it
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, "export.xml")
+        write_synthetic_export(path, records, grouped=True)
+        digest = f"bench-{records}"
+
+        default = main.CACHE_DIR, main.RECORD_INDEX, main.XML_BACKEND, main.SCAN_PROCESSES
+        results = {}
+        try:
+            main.CACHE_DIR, main.XML_BACKEND, main.SCAN_PROCESSES = Path(td), "fast", 1
+            for label, key in [("full", None), ("build", digest), ("indexed", digest)]:
+                main.RECORD_INDEX = key is not None
+                t = time.perf_counter()
+                workouts = main._scan_workouts(path, key)
+                single = time.perf_counter() - t
+                t = time.perf_counter()
+                results[label] = main._scan_parallel(path, digest=key).finalize(), workouts
+                every = time.perf_counter() - t
+                print(f"index      {label:<8} workouts {single:6.2f} s   all metrics {every:6.2f} s")
+        finally:
+            main.CACHE_DIR, main.RECORD_INDEX, main.XML_BACKEND, main.SCAN_PROCESSES = default
+        assert all(r == results["full"] for r in results.values())
+
+
+def bench_frames(records: int = 200_000) -> None:
+    # Memory of the parser's per-flag frames vs the projected frames the pandas engine keeps
+    with tempfile.TemporaryDirectory() as td:
+        xml_path = os.path.join(td, "export.xml")
+        write_synthetic_export(xml_path, records)
+        zip_path = os.path.join(td, "export.zip")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.write(xml_path, "apple_health_export/export.xml")
+
+        parser = main.Parser(export_file=zip_path, output_dir=td, overwrite=True)
+        for rtype, _ in _RECORD_TYPES[:6]:
+            full = parser.get_flag_records(flag=rtype).records
+            df = main._df_for(parser, rtype, text=rtype == "HKCategoryTypeIdentifierSleepAnalysis")
+            if df is None:
+                continue
+            before = full.memory_usage(deep=True).sum() / 2**20
+            after = df.memory_usage(deep=True).sum() / 2**20
+            print(f"frame      {rtype[24:]:<22} {len(df):8,} rows   {before:6.1f} MiB -> {after:5.1f} MiB")
+
+
+if __name__ == "__main__":
+    bench_dates()
+    bench_scan()
+    bench_index()
+    bench_frames()
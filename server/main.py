@@ -1,19 +1,150 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import math
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import time
+import uuid
+from array import array
 from collections import Counter, defaultdict
-from datetime import datetime, timezone
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import IO, Any, Callable, Collection, Dict, Iterable, MutableMapping, Optional, Union
 
+import numpy as np
 import pandas as pd
 import tempfile
 import xml.etree.ElementTree as ET
-from fastapi import FastAPI, File, UploadFile
+import zipfile
+from xml.parsers import expat
+from fastapi import FastAPI, File, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
 from apple_health_parser.utils.parser import Parser
 
-app = FastAPI()
+try:
+    from lxml import etree as LET
+except ImportError:  # stdlib ElementTree is the fallback backend
+    LET = None
+
+# "stream" runs the single-pass scanner; "pandas" keeps the apple-health-parser frames
+ENGINE = os.environ.get("HEALTH_WRAPPED_ENGINE", "stream")
+# XML backend for the scanners: "lxml" when installed ("auto"), otherwise "stdlib".
+# "expat" skips building elements; "fast" (opt-in) regex-scans the raw bytes.
+XML_BACKEND = os.environ.get("HEALTH_WRAPPED_XML_BACKEND", "auto")
+if XML_BACKEND == "auto" or (XML_BACKEND == "lxml" and LET is None):
+    XML_BACKEND = "lxml" if LET is not None else "stdlib"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+EXPAT_CHUNK_SIZE = 1024 * 1024
+FAST_CHUNK_SIZE = 8 * 1024 * 1024
+# Parsing runs in a "process" (default) or "thread" pool so the event loop stays free
+POOL_KIND = os.environ.get("HEALTH_WRAPPED_POOL", "process")
+POOL_WORKERS = int(os.environ.get("HEALTH_WRAPPED_WORKERS", os.cpu_count() or 1))
+# Processes one export.xml is split across; above 1, export.xml is extracted and its
+# byte ranges are scanned in parallel with the fast matcher
+SCAN_PROCESSES = int(os.environ.get("HEALTH_WRAPPED_SCAN_PROCESSES", 1))
+SCAN_RANGES_PER_PROCESS = 4  # smaller ranges even out uneven record density
+# Opt-in: the stream engine extracts export.xml and scans it with the fast matcher, which
+# notes where each wanted record type lies. The index is kept under CACHE_DIR by the
+# upload's digest, so a later analysis of the same export reads only those byte ranges.
+RECORD_INDEX = os.environ.get("HEALTH_WRAPPED_RECORD_INDEX", "0") == "1"
+INDEX_MIN_GAP = 64 * 1024  # runs of one type closer than this share a range
+INDEX_VERSION = 1  # bump whenever the stored index changes
+# Uploads beyond this many running + queued analyses are turned away with a 503
+MAX_PENDING = int(os.environ.get("HEALTH_WRAPPED_MAX_PENDING", POOL_WORKERS * 4))
+# Finished jobs (and their results) are kept this long for GET /jobs/{id}
+JOB_TTL_SECONDS = int(os.environ.get("HEALTH_WRAPPED_JOB_TTL", 3600))
+PROGRESS_EVERY = 50_000  # records between progress reports
+# Computed metrics are cached on disk by the upload's SHA-256; 0 bytes disables the cache
+CACHE_DIR = Path(os.environ.get("HEALTH_WRAPPED_CACHE_DIR", Path(tempfile.gettempdir()) / "health-wrapped-cache"))
+CACHE_MAX_BYTES = int(os.environ.get("HEALTH_WRAPPED_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_VERSION = 1  # bump whenever the metrics computed from an export change
+# Opt-in: the stream engine also keeps the scanned records as memory-mapped columns per
+# export, so a later analysis (say after a CACHE_VERSION bump) skips the XML entirely
+COLUMN_CACHE = os.environ.get("HEALTH_WRAPPED_COLUMN_CACHE", "0") == "1"
+# Columns have their own budget so one large export can't evict the cached metrics; a
+# scan stops collecting once its rows would not fit
+COLUMN_CACHE_MAX_BYTES = int(os.environ.get("HEALTH_WRAPPED_COLUMN_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+COLUMNS_VERSION = 1  # bump whenever the stored columns change
+COLUMN_SLICE = 1 << 16  # rows handed to the aggregators at a time when reading columns
+EVENTS_INTERVAL = 0.5  # seconds between checks for new progress on an event stream
+_QUEUED_PROGRESS: Dict[str, Any] = {
+    "phase": "queued",
+    "bytesParsed": 0,
+    "bytesTotal": 0,
+    "recordsSeen": 0,
+    "recordTypes": {},
+    "etaSeconds": None,
+    "phaseSeconds": {},
+}
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[Executor] = None
+_manager = None
+_progress: Optional[MutableMapping[str, Dict[str, Any]]] = None
+_pending = 0
+_jobs: Dict[str, Dict[str, Any]] = {}
+_job_tasks: set[asyncio.Task] = set()
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if POOL_KIND == "thread":
+            _executor = ThreadPoolExecutor(max_workers=POOL_WORKERS)
+        else:
+            # spawn: forking a process that runs an event loop and threads is unsafe
+            _executor = ProcessPoolExecutor(
+                max_workers=POOL_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+    return _executor
+
+
+def _discard_executor(executor: Executor) -> None:
+    # A process pool whose worker died (e.g. OOM-killed on a huge export) fails every
+    # later submit; drop it so the next request builds a fresh one
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _get_progress() -> MutableMapping[str, Dict[str, Any]]:
+    # Workers write job progress here; process workers need a manager-backed dict
+    global _manager, _progress
+    if _progress is None:
+        if POOL_KIND == "thread":
+            _progress = {}
+        else:
+            _manager = multiprocessing.get_context("spawn").Manager()
+            _progress = _manager.dict()
+    return _progress
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    yield
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+    if _manager is not None:
+        _manager.shutdown()
+
+
+app = FastAPI(lifespan=_lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -22,6 +153,26 @@ app.add_middleware(
 )
 
 
+class InvalidExport(Exception):
+    pass
+
+
+# Reported when a pool worker dies mid-analysis, typically killed for memory on a huge export
+WORKER_DIED = "The analysis worker stopped unexpectedly, try again shortly"
+
+
+class _CountingReader:
+    # Wraps the export.xml stream so progress can report uncompressed bytes consumed
+    def __init__(self, raw: IO[bytes]) -> None:
+        self.raw = raw
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.count += len(data)
+        return data
+
+
 def _safe_col(df: pd.DataFrame, *cands: str) -> Optional[str]:
     for c in cands:
         if c in df.columns:
@@ -29,12 +180,17 @@ def _safe_col(df: pd.DataFrame, *cands: str) -> Optional[str]:
     return None
 
 
-def _unwrap_value_series(df: pd.DataFrame) -> pd.DataFrame:
-    if "value" not in df.columns:
-        df["_value_raw"] = pd.NA
-        df["_value_num"] = pd.NA
-        df["_value_str"] = pd.NA
-        return df
+_NAT_INT = np.iinfo(np.int64).min  # NaT's int64 value; also marks missing epoch seconds
+
+# Inferred kinds of object columns that hold plain scalars, so nothing needs unwrapping
+_SCALAR_KINDS = {"string", "integer", "floating", "mixed-integer-float", "decimal", "boolean", "empty"}
+
+
+def _raw_values(col: pd.Series) -> pd.Series:
+    # Typed columns (numbers, strings) are used as is; only object columns holding
+    # wrapper objects take the per-row unwrap
+    if col.dtype != object or pd.api.types.infer_dtype(col, skipna=True) in _SCALAR_KINDS:
+        return col
 
     def _unwrap(v):
         try:
@@ -42,404 +198,1705 @@ def _unwrap_value_series(df: pd.DataFrame) -> pd.DataFrame:
         except Exception:
             return v
 
-    df["_value_raw"] = df["value"].map(_unwrap)
-    df["_value_num"] = pd.to_numeric(df["_value_raw"], errors="coerce")
-    df["_value_str"] = df["_value_raw"].astype(str)
-    return df
+    return col.map(_unwrap)
+
+
+def _unwrap_value_series(values: pd.Series, text: bool = False) -> Dict[str, Any]:
+    # _value_num, float32 when every value survives the round trip; with text=True a
+    # categorical _value for the sleep classification instead
+    raw = _raw_values(values)
+    if text:
+        return {"_value": raw.astype("category")}
+    num = raw if pd.api.types.is_numeric_dtype(raw) else pd.to_numeric(raw, errors="coerce")
+    wide = num.to_numpy(dtype="float64", na_value=np.nan)
+    narrow = wide.astype(np.float32)
+    return {"_value_num": narrow if np.array_equal(narrow, wide, equal_nan=True) else wide}
+
 
+def _epoch_seconds(col: Optional[pd.Series], rows: int) -> np.ndarray:
+    # Dates -> int64 UTC epoch seconds; missing or unparseable dates are _NAT_INT
+    if col is None:
+        return np.full(rows, _NAT_INT)
+    stamps = pd.to_datetime(col, errors="coerce", utc=True).values
+    per_second = np.timedelta64(1, "s") // np.timedelta64(1, np.datetime_data(stamps.dtype)[0])
+    ticks = stamps.view("i8")
+    return np.where(ticks == _NAT_INT, _NAT_INT, ticks // per_second)
 
-def _df_for(parser: Parser, flag: str) -> Optional[pd.DataFrame]:
+
+def _df_for(parser: Parser, flag: str, text: bool = False) -> Optional[pd.DataFrame]:
     try:
         parsed = parser.get_flag_records(flag=flag)  # -> ParsedData
-        df = parsed.records.copy()
-        if df.empty:
+        records = parsed.records
+        if records.empty:
             return None
 
-        # dates -> tz-aware UTC
-        sd = _safe_col(df, "start_date", "startDate")
-        ed = _safe_col(df, "end_date", "endDate")
-        if sd:
-            df[sd] = pd.to_datetime(df[sd], errors="coerce", utc=True)
-        if ed:
-            df[ed] = pd.to_datetime(df[ed], errors="coerce", utc=True)
-
-        df = _unwrap_value_series(df)
-
-        df["_sd"] = df[sd] if sd else pd.NaT
-        df["_ed"] = df[ed] if ed else pd.NaT
+        # Only the columns the metrics read; the parser's frame is left untouched
+        sd = _safe_col(records, "start_date", "startDate")
+        ed = _safe_col(records, "end_date", "endDate")
+        columns = {
+            "_sd": _epoch_seconds(records[sd] if sd else None, len(records)),
+            "_ed": _epoch_seconds(records[ed] if ed else None, len(records)),
+            **_unwrap_value_series(records.get("value", pd.Series(np.nan, index=records.index)), text),
+        }
+        df = pd.DataFrame(columns, index=records.index, copy=False)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "%s frame: %d rows, %.2f MiB -> %.2f MiB",
+                flag,
+                len(df),
+                records.memory_usage(deep=True).sum() / 2**20,
+                df.memory_usage(deep=True).sum() / 2**20,
+            )
         return df
     except Exception:
         return None
 
 
-def _period_key(series: pd.Series, freq: str) -> pd.Series:
-    return series.dt.tz_convert("UTC").dt.to_period(freq)
+def _values(df: pd.DataFrame) -> np.ndarray:
+    # _value_num widened back to float64 so sums don't accumulate in float32
+    return df["_value_num"].to_numpy(dtype="float64", na_value=np.nan)
 
 
-def _scan_records_once(xml_file: str) -> Dict[str, Any]:
-    # Aggregators
-    steps_total = 0
-    steps_daily = defaultdict(float)  # day -> steps
-    steps_monthly = defaultdict(float)
+def _spans(df: pd.DataFrame) -> np.ndarray:
+    # Seconds from start to end clipped at 0, NaN where either date is missing
+    sd, ed = df["_sd"].to_numpy(), df["_ed"].to_numpy()
+    return np.where((sd != _NAT_INT) & (ed != _NAT_INT), np.clip(ed - sd, 0, None), np.nan)
 
-    energy_total = 0.0
-    energy_daily = defaultdict(float)
 
-    hr_sum = 0.0
-    hr_count = 0
-    rhr_sum = 0.0
-    rhr_count = 0
+def _day_values(starts: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # UTC epoch day of each row's start and its value, for rows that have a start
+    has_start = starts != _NAT_INT
+    values = values[has_start]
+    # NaN counts as 0, like groupby().sum()
+    return starts[has_start] // 86_400, np.where(np.isnan(values), 0.0, values)
 
-    sleep_total_hours = 0.0
-    sleep_monthly_hours = defaultdict(float)
-    sleep_night_dates = set()  # YYYY-MM-DD strings
 
-    mindful_total_min = 0.0
-    mindful_sessions = 0
+def _rollup(keys: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Sums per integer key -> (keys present, ascending; their sums)
+    if not keys.size:
+        return keys, values
+    lo = keys.min()
+    counts = np.bincount(keys - lo)
+    sums = np.bincount(keys - lo, weights=values)
+    present = np.flatnonzero(counts)
+    return present + lo, sums[present]
 
-    def _parse_dt(s: Optional[str]) -> Optional[datetime]:
-        if not s:
-            return None
-        # Apple format: "YYYY-MM-DD HH:mm:ss +HHMM"
+
+def _monthly(days: np.ndarray, sums: np.ndarray) -> tuple[list[str], np.ndarray]:
+    # Daily rollup -> "YYYY-MM" labels and sums, in calendar order
+    months, sums = _rollup(days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64), sums)
+    return list(np.datetime_as_string(months.astype("datetime64[M]"), unit="M")), sums
+
+
+def _workout_entry(attrib: Dict[str, str]) -> tuple[str, float]:
+    kind = (attrib.get("workoutActivityType") or "Other").replace("HKWorkoutActivityType", "")
+    dur = attrib.get("duration")
+    unit = (attrib.get("durationUnit") or "").lower()
+    try:
+        d = float(dur) if dur is not None else 0.0
+        if unit in {"hr", "hour", "hours"}:
+            d *= 60.0
+    except ValueError:
+        d = 0.0
+    return kind, d
+
+
+def _iter_stdlib(xml_file: Union[str, IO[bytes]], tags: tuple[str, ...]):
+    # Iterate on end events, holding the root so finished children can be detached
+    context = ET.iterparse(xml_file, events=("start", "end"))
+    _, root = next(context)  # HealthData
+    depth = 0
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            # A top-level child (Record, Workout, Correlation, ...) is complete; the
+            # attributes stay readable on elem but the root no longer references it.
+            root.clear()
+        if elem.tag in tags:
+            yield elem.tag, elem.attrib
+
+
+def _iter_lxml(xml_file: Union[str, IO[bytes]], tags: tuple[str, ...]):
+    # Every element's end is seen, not just the wanted tags: top-level children are only
+    # freed as they end, and a tag filter would leave e.g. all Records in the tree while
+    # a workouts-only scan waits for the Workouts Apple writes last
+    context = LET.iterparse(xml_file, events=("end",), huge_tree=True, resolve_entities=False)
+    root = None
+    for _, elem in context:
+        parent = elem.getparent()
+        if parent is None:
+            continue  # HealthData itself, at the very end
+        if root is None:
+            root = parent
+            while root.getparent() is not None:
+                root = root.getparent()
+        if elem.tag in tags:
+            yield elem.tag, elem.attrib
+        if parent is root:
+            # The attrib proxy dies with the element, so consumers must be done with it here
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del parent[0]
+
+
+def _feed_expat(xml_file: Union[str, IO[bytes]], start: Callable[[str, Dict[str, str]], None]) -> None:
+    # Push-style: start(tag, attrs) runs from pyexpat's callback for every start tag
+    parser = expat.ParserCreate()
+    parser.buffer_text = False
+    parser.StartElementHandler = start
+
+    f = open(xml_file, "rb") if isinstance(xml_file, str) else xml_file
+    try:
+        while chunk := f.read(EXPAT_CHUNK_SIZE):
+            parser.Parse(chunk, False)
+        parser.Parse(b"", True)
+    finally:
+        if f is not xml_file:
+            f.close()
+
+
+def _iter_expat(xml_file: Union[str, IO[bytes]], tags: tuple[str, ...]):
+    # SAX-style: no Element objects at all, only the attribute dicts of wanted tags.
+    # Matches are collected per chunk and handed out before the next read.
+    pending: list[tuple[str, Dict[str, str]]] = []
+
+    def start(tag: str, attrs: Dict[str, str]) -> None:
+        if tag in tags:
+            pending.append((tag, attrs))
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = False
+    parser.StartElementHandler = start
+
+    f = open(xml_file, "rb") if isinstance(xml_file, str) else xml_file
+    try:
+        while chunk := f.read(EXPAT_CHUNK_SIZE):
+            parser.Parse(chunk, False)
+            yield from pending
+            pending.clear()
+        parser.Parse(b"", True)
+        yield from pending
+    finally:
+        if f is not xml_file:
+            f.close()
+
+
+# Attributes the scanners read; the fast scan extracts nothing else
+_FAST_ATTRS = {  # applied to the decoded attribute tail of each match
+    "Record": re.compile(r'\s(startDate|endDate|value)="([^"]*)"'),
+    "Workout": re.compile(r'\s(workoutActivityType|duration|durationUnit)="([^"]*)"'),
+}
+
+
+@lru_cache(maxsize=None)
+def _fast_pattern(tags: tuple[str, ...], record_types: Optional[tuple[str, ...]]) -> re.Pattern:
+    # Apple writes `<Record type="..."` with type first, so unwanted types fail the
+    # alternation right after the tag name. Group 1 is the record type (None for a
+    # Workout), group 2 the remaining attributes.
+    if "Record" not in tags:
+        types = b"(?!)"  # keeps group 1 in place but never matches
+    elif record_types:
+        types = b"|".join(re.escape(t.encode()) for t in record_types)
+    else:
+        types = rb'[^"]*'
+    alts = [rb'Record type="(' + types + rb')"']
+    if "Workout" in tags:
+        alts.append(rb"Workout\b")
+    return re.compile(rb"<(?:" + b"|".join(alts) + rb")([^>]*)>")
+
+
+class _RecordIndex:
+    # Byte ranges per record type ("Workout" for workouts), noted by the fast matcher as
+    # it scans. A range runs from the first tag of a run to the end of its last, so it
+    # holds every matched tag of its type; runs of one type closer than INDEX_MIN_GAP
+    # share a range, which keeps the index small even for interleaved files.
+    def __init__(self, kinds: Collection[str]) -> None:
+        self.kinds = sorted(kinds)  # types the scan matched; others are not indexed
+        self.ranges: Dict[str, list[list[int]]] = {}
+        self._kind: Optional[str] = None
+        self._run: Optional[list[int]] = None
+
+    def add(self, kind: str, start: int, end: int) -> None:
+        if kind == self._kind:
+            self._run[1] = end
+            return
+        self._kind = kind
+        self._run = self._extend(self.ranges.setdefault(kind, []), start, end)
+
+    @staticmethod
+    def _extend(spans: list[list[int]], start: int, end: int) -> list[int]:
+        if spans and start - spans[-1][1] < INDEX_MIN_GAP:
+            spans[-1][1] = max(spans[-1][1], end)  # short gap: the previous range grows over it
+        else:
+            spans.append([start, end])
+        return spans[-1]
+
+    def merge(self, other: "_RecordIndex") -> "_RecordIndex":
+        # other covers a later part of the same file
+        for kind, spans in other.ranges.items():
+            mine = self.ranges.setdefault(kind, [])
+            for start, end in spans:
+                self._extend(mine, start, end)
+        self._kind = self._run = None
+        return self
+
+
+def _index_ranges(ranges: Dict[str, list[list[int]]], kinds: Collection[str]) -> list[tuple[int, int]]:
+    # Disjoint ranges in file order covering every element of the given types
+    merged: list[list[int]] = []
+    for start, end in sorted(span for kind in kinds for span in ranges.get(kind, ())):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def _fast_matches(
+    pattern: re.Pattern,
+    buf: Any,
+    pos: int = 0,
+    endpos: Optional[int] = None,
+    index: Optional[_RecordIndex] = None,
+):
+    # buf may be bytes or an mmap; finditer reads either in place without copying it.
+    # With an index, the position of every match is noted in it.
+    record_attrs = _FAST_ATTRS["Record"]
+    workout_attrs = _FAST_ATTRS["Workout"]
+    for m in pattern.finditer(buf, pos, len(buf) if endpos is None else endpos):
+        rtype, rest = m.groups()
+        rest = rest.decode("utf-8")
+        if rtype is not None:
+            attrib = dict(record_attrs.findall(rest))
+            attrib["type"] = kind = rtype.decode("utf-8")
+            tag = "Record"
+        else:
+            attrib = dict(workout_attrs.findall(rest))
+            tag = kind = "Workout"
+        if index is not None:
+            index.add(kind, m.start(), m.end())
+        if "&" in rest:
+            attrib = {k: html.unescape(v) for k, v in attrib.items()}
+        yield tag, attrib
+
+
+def _iter_fast(
+    xml_file: Union[str, IO[bytes]],
+    tags: tuple[str, ...],
+    record_types: Optional[Collection[str]] = None,
+    ranges: Optional[list[tuple[int, int]]] = None,
+    index: Optional[_RecordIndex] = None,
+):
+    # Regex scan of the raw bytes instead of an XML parse, relying on the layout Apple
+    # writes. Records of types outside record_types fail the match right after the tag
+    # name, and only the attributes in _FAST_ATTRS are decoded. For a file on disk,
+    # ranges (from a stored index) limit the scan and index collects a new one.
+    pattern = _fast_pattern(tags, tuple(sorted(record_types)) if record_types else None)
+
+    if isinstance(xml_file, str):
+        # A file on disk is memory-mapped: no user-space copy, and concurrent scans of
+        # the same file share the OS page cache
+        with open(xml_file, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                for start, end in [(0, len(mm))] if ranges is None else ranges:
+                    yield from _fast_matches(pattern, mm, start, end, index)
+        return
+
+    # Streams (e.g. a zip member) are read in chunks cut after the last ">" so no tag
+    # straddles two of them
+    carry = b""
+    while chunk := xml_file.read(FAST_CHUNK_SIZE):
+        buf = carry + chunk
+        cut = buf.rfind(b">") + 1
+        carry = buf[cut:]
+        yield from _fast_matches(pattern, buf, 0, cut)
+    yield from _fast_matches(pattern, carry)
+
+
+def _iter_elements(
+    xml_file: Union[str, IO[bytes]],
+    tags: tuple[str, ...],
+    record_types: Optional[Collection[str]] = None,
+):
+    # Yields (tag, attrib) for every element named in tags with bounded memory.
+    # Backends may skip Records whose type is not in record_types.
+    if XML_BACKEND == "fast":
+        return _iter_fast(xml_file, tags, record_types)
+    if XML_BACKEND == "expat":
+        return _iter_expat(xml_file, tags)
+    if XML_BACKEND == "lxml":
+        return _iter_lxml(xml_file, tags)
+    return _iter_stdlib(xml_file, tags)
+
+
+def _scan_workouts(xml_file: Union[str, IO[bytes]], digest: Optional[str] = None) -> Dict[str, Any]:
+    workouts = _WorkoutAggregator()
+    if digest and RECORD_INDEX and XML_BACKEND == "fast" and isinstance(xml_file, str):
+        ranges, index = _index_lookup(digest, xml_file, ("Workout",))
+        elements = _iter_fast(xml_file, ("Workout",), ranges=ranges, index=index)
+    else:
+        index = None
+        elements = _iter_elements(xml_file, ("Workout",))
+    for _, attrib in elements:
+        workouts.update(attrib)
+    if index is not None:
+        _index_put(digest, xml_file, index)
+    return workouts.finalize()
+
+
+def _to_float(val: Optional[str]) -> float:
+    try:
+        return float(val) if val is not None else 0.0
+    except Exception:
+        return 0.0
+
+
+_TZ_CACHE: Dict[str, timezone] = {}  # "+HHMM" -> tzinfo
+_DT_PATTERN = re.compile(r"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d) ([+-]\d{4})", re.ASCII)
+
+
+def _parse_dt(s: Optional[str]) -> Optional[datetime]:
+    if not s:
+        return None
+    # Apple format: "YYYY-MM-DD HH:mm:ss +HHMM". The pattern takes digits only, as strptime
+    # does (int() alone would also take a sign or spaces), and anything else falls through.
+    m = _DT_PATTERN.fullmatch(s)
+    if m is not None:
+        year, month, day, hour, minute, second, off = m.groups()
+        tz = _TZ_CACHE.get(off)
+        try:
+            if tz is None:
+                minutes = int(off[1:3]) * 60 + int(off[3:5])
+                tz = _TZ_CACHE[off] = timezone(timedelta(minutes=-minutes if off[0] == "-" else minutes))
+            return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), tzinfo=tz)
+        except ValueError:
+            pass
+    try:
+        return datetime.strptime(s, "%Y-%m-%d %H:%M:%S %z")
+    except Exception:
+        # Try ISO-ish fallback
         try:
-            return datetime.strptime(s, "%Y-%m-%d %H:%M:%S %z")
+            return datetime.fromisoformat(s.replace(" ", "T"))
         except Exception:
-            # Try ISO-ish fallback
-            try:
-                return datetime.fromisoformat(s.replace(" ", "T"))
-            except Exception:
-                return None
-
-    asleep_values = {
-        "HKCategoryValueSleepAnalysisAsleep",
-        "HKCategoryValueSleepAnalysisAsleepCore",
-        "HKCategoryValueSleepAnalysisAsleepDeep",
-        "HKCategoryValueSleepAnalysisAsleepREM",
-        "HKCategoryValueSleepAnalysisAsleepUnspecified",
-        "1",
-    }
+            return None
 
-    # Iterate
-    for event, elem in ET.iterparse(xml_file, events=("start",)):
-        if elem.tag != "Record":
-            continue
 
-        rtype = elem.attrib.get("type")
-        if not rtype:
-            elem.clear()
-            continue
+_EPOCH_DATE = date(1970, 1, 1)
+_MONTH_KEYS: Dict[int, str] = {}  # UTC epoch day -> "YYYY-MM"
 
-        # Common attrs
-        start = _parse_dt(elem.attrib.get("startDate"))
-        end = _parse_dt(elem.attrib.get("endDate"))
-        val = elem.attrib.get("value")
 
-        # Steps
-        if rtype == "HKQuantityTypeIdentifierStepCount":
-            try:
-                v = float(val) if val is not None else 0.0
-            except Exception:
-                v = 0.0
-            if start and v > 0:
-                steps_total += v
-                day = start.astimezone(timezone.utc).strftime("%Y-%m-%d")
-                month = start.astimezone(timezone.utc).strftime("%Y-%m")
-                steps_daily[day] += v
-                steps_monthly[month] += v
-            elem.clear()
-            continue
+def _utc_day(dt: datetime) -> int:
+    # Days since 1970-01-01 in UTC; same bucket as astimezone(utc).date() without formatting
+    return int(dt.timestamp() // 86400)
 
-        # Active energy
-        if rtype == "HKQuantityTypeIdentifierActiveEnergyBurned":
-            try:
-                v = float(val) if val is not None else 0.0
-            except Exception:
-                v = 0.0
-            if start and v > 0:
-                energy_total += v
-                day = start.astimezone(timezone.utc).strftime("%Y-%m-%d")
-                energy_daily[day] += v
-            elem.clear()
-            continue
 
-        # Heart rate / Resting HR
-        if rtype == "HKQuantityTypeIdentifierHeartRate":
-            try:
-                v = float(val) if val is not None else 0.0
-            except Exception:
-                v = 0.0
-            if v > 0:
-                hr_sum += v
-                hr_count += 1
-            elem.clear()
-            continue
+def _month_key(day: int) -> str:
+    key = _MONTH_KEYS.get(day)
+    if key is None:
+        key = _MONTH_KEYS[day] = (_EPOCH_DATE + timedelta(days=day)).strftime("%Y-%m")
+    return key
 
-        if rtype == "HKQuantityTypeIdentifierRestingHeartRate":
-            try:
-                v = float(val) if val is not None else 0.0
-            except Exception:
-                v = 0.0
-            if v > 0:
-                rhr_sum += v
-                rhr_count += 1
-            elem.clear()
-            continue
 
-        # Sleep (asleep segments only)
-        if rtype == "HKCategoryTypeIdentifierSleepAnalysis":
-            if start and end and end > start:
-                raw = val or ""
-                if raw in asleep_values or "Asleep" in raw:
-                    hours = (end - start).total_seconds() / 3600.0
-                    if hours > 0:
-                        sleep_total_hours += hours
-                        month = start.astimezone(timezone.utc).strftime("%Y-%m")
-                        day = start.astimezone(timezone.utc).strftime("%Y-%m-%d")
-                        sleep_monthly_hours[month] += hours
-                        sleep_night_dates.add(day)
-            elem.clear()
-            continue
+class _DailySeries:
+    # Per-UTC-day sums in one array('d') indexed by epoch day minus `start`. It grows in
+    # either direction on demand; only positive amounts are added, so 0.0 means no data.
+    __slots__ = ("start", "values")
 
-        # Mindful session
-        if rtype == "HKCategoryTypeIdentifierMindfulSession":
-            if start and end and end > start:
-                minutes = (end - start).total_seconds() / 60.0
-                if minutes > 0:
-                    mindful_total_min += minutes
-                    mindful_sessions += 1
-            elem.clear()
-            continue
+    def __init__(self) -> None:
+        self.start = 0
+        self.values = array("d")
+
+    def add(self, day: int, v: float) -> None:
+        i = day - self.start
+        if 0 <= i < len(self.values):
+            self.values[i] += v
+        else:
+            self._cover(day)
+            self.values[day - self.start] += v
+
+    def _cover(self, day: int) -> None:
+        if not self.values:
+            self.start = day
+            self.values = array("d", [0.0])
+        elif day < self.start:
+            self.values = array("d", bytes(8 * (self.start - day))) + self.values
+            self.start = day
+        elif day >= self.start + len(self.values):
+            self.values.frombytes(bytes(8 * (day - self.start - len(self.values) + 1)))
+
+    def add_many(self, days: np.ndarray, values: np.ndarray) -> None:
+        # Same sums as add() row by row: np.add.at adds element by element in row order
+        if not days.size:
+            return
+        self._cover(int(days.min()))
+        self._cover(int(days.max()))
+        np.add.at(np.frombuffer(self.values, dtype=np.float64), days - self.start, values)
+
+    def merge(self, other: "_DailySeries") -> None:
+        if not other.values:
+            return
+        self._cover(other.start)
+        self._cover(other.start + len(other.values) - 1)
+        offset = other.start - self.start
+        values = self.values
+        for i, v in enumerate(other.values):
+            if v:
+                values[offset + i] += v
+
+    def days(self) -> int:
+        return sum(1 for v in self.values if v)
+
+    def monthly(self) -> Dict[str, float]:
+        # "YYYY-MM" -> sum, in calendar order
+        months: Dict[str, float] = defaultdict(float)
+        for i, v in enumerate(self.values):
+            if v:
+                months[_month_key(self.start + i)] += v
+        return months
+
+
+class _ExactSum:
+    # Running float total that doesn't depend on how the values were split or ordered:
+    # values are buffered and folded into non-overlapping partials whose sum is exact,
+    # and value() rounds that sum once. Parallel byte ranges and column reloads then
+    # give the same totals as a sequential scan.
+    __slots__ = ("partials", "pending", "add")
+
+    FOLD_SLICE = 1 << 16  # values converted to Python floats at a time
+
+    def __init__(self) -> None:
+        self.partials: list[float] = []
+        self.pending = array("d")
+        # add(v) is the buffer's own append, as cheap as a float +=; the owner calls
+        # fold() now and then to keep the buffer short
+        self.add = self.pending.append
+
+    def __getstate__(self) -> tuple[list[float], array]:
+        return self.partials, self.pending
+
+    def __setstate__(self, state: tuple[list[float], array]) -> None:
+        self.partials, self.pending = state
+        self.add = self.pending.append
+
+    def add_many(self, values: Any) -> None:
+        # Column slices are folded one at a time, so a memory-mapped column is never
+        # copied whole into Python floats
+        values = np.asarray(values, dtype=np.float64)
+        for i in range(0, len(values), self.FOLD_SLICE):
+            self._fold(values[i : i + self.FOLD_SLICE].tolist())
+
+    def fold(self) -> None:
+        if self.pending:
+            self._fold(self.pending.tolist())
+            del self.pending[:]  # in place: add stays bound to it
+
+    def _fold(self, values: list[float]) -> None:
+        # fsum rounds the exact sum once; the residual after subtracting it is exact
+        # again, so peeling off fsum() until it is 0 leaves the exact sum as partials
+        terms = self.partials + values
+        partials = []
+        while (hi := math.fsum(terms)) != 0.0:
+            partials.append(hi)
+            terms.append(-hi)
+        self.partials = partials
+
+    def merge(self, other: "_ExactSum") -> None:
+        self._fold(other.partials + other.pending.tolist())
+
+    def value(self) -> float:
+        return math.fsum(self.partials + self.pending.tolist())
+
+
+def _utc_days(seconds: np.ndarray) -> np.ndarray:
+    return np.floor_divide(seconds, 86400).astype(np.int64)
+
+
+# Metric aggregators. Each one is fed record by record through update(), can absorb
+# another aggregator of the same kind through merge() (byte ranges scanned in other
+# processes, a later export) and renders its block of the scan result in finalize().
+# fold() compacts the buffered values of its exact sums; scans call it periodically.
+# update_columns() takes whole columns from the column cache instead: start/end in UTC
+# epoch seconds (NaN when missing) and the values, giving the same sums as update().
+class _StepsAggregator:
+    needs_start, needs_end = True, False
+
+    def __init__(self) -> None:
+        self.total = _ExactSum()
+        self.daily = _DailySeries()
+
+    def update(self, start: Optional[datetime], end: Optional[datetime], val: Optional[str]) -> None:
+        v = _to_float(val)
+        if start and v > 0:
+            self.total.add(v)
+            self.daily.add(_utc_day(start), v)
+
+    def update_columns(self, start: np.ndarray, end: np.ndarray, values: np.ndarray) -> None:
+        keep = ~np.isnan(start) & (values > 0)
+        self.total.add_many(values[keep])
+        self.daily.add_many(_utc_days(start[keep]), values[keep])
+
+    def fold(self) -> None:
+        self.total.fold()
+
+    def merge(self, other: "_StepsAggregator") -> None:
+        self.total.merge(other.total)
+        self.daily.merge(other.daily)
+
+    def finalize(self) -> Dict[str, Any]:
+        monthly = self.daily.monthly()
+        total = self.total.value()
+        return {
+            "total": int(round(total)),
+            "average": int(round(total / max(1, self.daily.days()))),
+            "bestMonth": max(monthly, key=lambda k: monthly[k]) if monthly else "",  # "YYYY-MM"
+            "monthlyData": [{"month": m, "value": int(round(v))} for m, v in sorted(monthly.items())],
+        }
+
+
+class _EnergyAggregator:
+    needs_start, needs_end = True, False
+
+    def __init__(self) -> None:
+        self.total = _ExactSum()
+        self.daily = _DailySeries()
+
+    def update(self, start: Optional[datetime], end: Optional[datetime], val: Optional[str]) -> None:
+        v = _to_float(val)
+        if start and v > 0:
+            self.total.add(v)
+            self.daily.add(_utc_day(start), v)
+
+    def update_columns(self, start: np.ndarray, end: np.ndarray, values: np.ndarray) -> None:
+        keep = ~np.isnan(start) & (values > 0)
+        self.total.add_many(values[keep])
+        self.daily.add_many(_utc_days(start[keep]), values[keep])
+
+    def fold(self) -> None:
+        self.total.fold()
+
+    def merge(self, other: "_EnergyAggregator") -> None:
+        self.total.merge(other.total)
+        self.daily.merge(other.daily)
+
+    def finalize(self) -> Dict[str, Any]:
+        total = self.total.value()
+        return {
+            "total": total,
+            "average": int(round(total / max(1, self.daily.days()))),
+        }
+
+
+class _MeanAggregator:
+    # Heart rate and resting heart rate: positive values only
+    needs_start, needs_end = False, False
+
+    def __init__(self) -> None:
+        self.sum = _ExactSum()
+        self.count = 0
+
+    def update(self, start: Optional[datetime], end: Optional[datetime], val: Optional[str]) -> None:
+        v = _to_float(val)
+        if v > 0:
+            self.sum.add(v)
+            self.count += 1
+
+    def update_columns(self, start: np.ndarray, end: np.ndarray, values: np.ndarray) -> None:
+        values = values[values > 0]
+        self.sum.add_many(values)
+        self.count += int(values.size)
+
+    def fold(self) -> None:
+        self.sum.fold()
+
+    def merge(self, other: "_MeanAggregator") -> None:
+        self.sum.merge(other.sum)
+        self.count += other.count
+
+    def finalize(self) -> int:
+        return int(round(self.sum.value() / self.count)) if self.count else 0
+
+
+_ASLEEP_VALUES = {
+    "HKCategoryValueSleepAnalysisAsleep",
+    "HKCategoryValueSleepAnalysisAsleepCore",
+    "HKCategoryValueSleepAnalysisAsleepDeep",
+    "HKCategoryValueSleepAnalysisAsleepREM",
+    "HKCategoryValueSleepAnalysisAsleepUnspecified",
+    "1",
+}
+
+
+class _SleepAggregator:
+    # Asleep segments only
+    needs_start, needs_end = True, True
+
+    def __init__(self) -> None:
+        self.total_hours = _ExactSum()
+        self.daily_hours = _DailySeries()  # nights are the days holding any hours
+
+    def update(self, start: Optional[datetime], end: Optional[datetime], val: Optional[str]) -> None:
+        if start and end and end > start:
+            raw = val or ""
+            if raw in _ASLEEP_VALUES or "Asleep" in raw:
+                hours = (end - start).total_seconds() / 3600.0
+                if hours > 0:
+                    self.total_hours.add(hours)
+                    self.daily_hours.add(_utc_day(start), hours)
+
+    def update_columns(self, start: np.ndarray, end: np.ndarray, values: pd.Categorical) -> None:
+        # Each distinct value is classified once; missing values (code -1) land on the False
+        asleep = np.array([raw in _ASLEEP_VALUES or "Asleep" in raw for raw in values.categories] + [False])
+        keep = asleep[values.codes] & ~np.isnan(start) & ~np.isnan(end) & (end > start)
+        hours = (end[keep] - start[keep]) / 3600.0
+        positive = hours > 0
+        self.total_hours.add_many(hours[positive])
+        self.daily_hours.add_many(_utc_days(start[keep][positive]), hours[positive])
+
+    def fold(self) -> None:
+        self.total_hours.fold()
+
+    def merge(self, other: "_SleepAggregator") -> None:
+        self.total_hours.merge(other.total_hours)
+        self.daily_hours.merge(other.daily_hours)
+
+    def finalize(self) -> Dict[str, Any]:
+        monthly = self.daily_hours.monthly()
+        total = self.total_hours.value()
+        return {
+            "totalHours": round(total, 2),
+            "averageHours": round(total / max(1, self.daily_hours.days()), 2) if total else 0.0,
+            "bestMonth": max(monthly, key=lambda k: monthly[k]) if monthly else "",
+        }
+
+
+class _MindfulAggregator:
+    needs_start, needs_end = True, True
+
+    def __init__(self) -> None:
+        self.total_minutes = _ExactSum()
+        self.sessions = 0
+
+    def update(self, start: Optional[datetime], end: Optional[datetime], val: Optional[str]) -> None:
+        if start and end and end > start:
+            minutes = (end - start).total_seconds() / 60.0
+            if minutes > 0:
+                self.total_minutes.add(minutes)
+                self.sessions += 1
+
+    def update_columns(self, start: np.ndarray, end: np.ndarray, values: np.ndarray) -> None:
+        keep = ~np.isnan(start) & ~np.isnan(end) & (end > start)
+        minutes = (end[keep] - start[keep]) / 60.0
+        minutes = minutes[minutes > 0]
+        self.total_minutes.add_many(minutes)
+        self.sessions += int(minutes.size)
+
+    def fold(self) -> None:
+        self.total_minutes.fold()
+
+    def merge(self, other: "_MindfulAggregator") -> None:
+        self.total_minutes.merge(other.total_minutes)
+        self.sessions += other.sessions
+
+    def finalize(self) -> Dict[str, Any]:
+        total = self.total_minutes.value()
+        return {
+            "total": round(total, 2) if total else 0.0,
+            "sessions": int(self.sessions),
+        }
+
+
+class _WorkoutAggregator:
+    def __init__(self) -> None:
+        self.count = 0
+        self.types: Counter = Counter()
+        self.total_minutes = _ExactSum()
 
-        # discard any other record
-        elem.clear()
+    def update(self, attrib: Dict[str, str]) -> None:
+        self.add(*_workout_entry(attrib))
 
-    # Build result
-    steps_days = max(1, len(steps_daily))
-    energy_days = max(1, len(energy_daily))
-    sleep_nights = max(1, len(sleep_night_dates))
+    def add(self, kind: str, minutes: float) -> None:
+        self.count += 1
+        self.types[kind] += 1
+        self.total_minutes.add(minutes)
 
-    steps_monthly_sorted = sorted(steps_monthly.items())
-    best_steps_month = ""
-    if steps_monthly:
-        best_steps_month = max(steps_monthly, key=lambda k: steps_monthly[k])  # "YYYY-MM"
+    def update_columns(self, kinds: pd.Categorical, minutes: np.ndarray) -> None:
+        # Categories are stored in order of first appearance, like the Counter's keys
+        self.count += len(kinds)
+        for kind, n in zip(kinds.categories, np.bincount(kinds.codes, minlength=len(kinds.categories))):
+            self.types[kind] += int(n)
+        self.total_minutes.add_many(minutes)
 
-    best_sleep_month = ""
-    if sleep_monthly_hours:
-        best_sleep_month = max(sleep_monthly_hours, key=lambda k: sleep_monthly_hours[k])
+    def fold(self) -> None:
+        self.total_minutes.fold()
+
+    def merge(self, other: "_WorkoutAggregator") -> None:
+        self.count += other.count
+        self.types.update(other.types)
+        self.total_minutes.merge(other.total_minutes)
+
+    def finalize(self) -> Dict[str, Any]:
+        return {
+            "total": int(self.count),
+            "types": dict(self.types),
+            "totalMinutes": int(round(self.total_minutes.value())),
+        }
+
+
+# Record types whose values are kept as text in the column cache
+_TEXT_VALUE_TYPES = {"HKCategoryTypeIdentifierSleepAnalysis"}
+
+
+class _RecordColumns:
+    # Scanned rows kept column by column for the column cache: start/end as UTC epoch
+    # seconds (NaN when missing), values as floats or, for text types, the raw strings
+    def __init__(self) -> None:
+        self.rows: Dict[str, tuple[array, array, Any]] = {}
+        self.workout_kinds: list[str] = []
+        self.workout_minutes = array("d")
+
+    def _columns_for(self, rtype: str) -> tuple[array, array, Any]:
+        if rtype not in self.rows:
+            self.rows[rtype] = (array("d"), array("d"), [] if rtype in _TEXT_VALUE_TYPES else array("d"))
+        return self.rows[rtype]
+
+    def recorder(self, rtype: str, update: Callable) -> Callable:
+        # Wraps an aggregator's update so each row is also kept
+        starts, ends, values = self._columns_for(rtype)
+        text = rtype in _TEXT_VALUE_TYPES
+        nan = float("nan")
+
+        def record(start: Optional[datetime], end: Optional[datetime], val: Optional[str]) -> None:
+            starts.append(start.timestamp() if start else nan)
+            ends.append(end.timestamp() if end else nan)
+            values.append((val or "") if text else _to_float(val))
+            update(start, end, val)
+
+        return record
+
+    def workout_recorder(self, add: Callable[[str, float], None]) -> Callable:
+        def record(attrib: Dict[str, str]) -> None:
+            kind, minutes = _workout_entry(attrib)
+            self.workout_kinds.append(kind)
+            self.workout_minutes.append(minutes)
+            add(kind, minutes)
+
+        return record
+
+    def nbytes(self) -> int:
+        # Size once stored: 8-byte floats, or 4-byte codes for text
+        rows = sum(len(starts) for starts, _, _ in self.rows.values())
+        return rows * 24 + len(self.workout_minutes) * 12
+
+    def merge(self, other: "_RecordColumns") -> None:
+        for rtype, columns in other.rows.items():
+            for mine, theirs in zip(self._columns_for(rtype), columns):
+                mine.extend(theirs)
+        self.workout_kinds.extend(other.workout_kinds)
+        self.workout_minutes.extend(other.workout_minutes)
+
+
+class _RecordScan:
+    # Every aggregator for one pass over export.xml, or one byte range of it. With
+    # collect=True the scanned rows are also kept in .columns for the column cache.
+    def __init__(self, collect: bool = False) -> None:
+        self.steps = _StepsAggregator()
+        self.energy = _EnergyAggregator()
+        self.heart_rate = _MeanAggregator()
+        self.resting_heart_rate = _MeanAggregator()
+        self.sleep = _SleepAggregator()
+        self.mindful = _MindfulAggregator()
+        self.workouts = _WorkoutAggregator()
+        self.records_seen = 0
+        self.type_counts: Counter = Counter()  # record type -> records seen, for progress reporting
+        self.columns = _RecordColumns() if collect else None
+
+    def aggregators(self) -> Dict[str, Any]:
+        # Record type -> aggregator; every other type is skipped
+        return {
+            "HKQuantityTypeIdentifierStepCount": self.steps,
+            "HKQuantityTypeIdentifierActiveEnergyBurned": self.energy,
+            "HKQuantityTypeIdentifierHeartRate": self.heart_rate,
+            "HKQuantityTypeIdentifierRestingHeartRate": self.resting_heart_rate,
+            "HKCategoryTypeIdentifierSleepAnalysis": self.sleep,
+            "HKCategoryTypeIdentifierMindfulSession": self.mindful,
+        }
+
+    def fold(self) -> None:
+        for agg in self.aggregators().values():
+            agg.fold()
+        self.workouts.fold()
+
+    def _dispatch(self) -> tuple[Dict[str, tuple[Callable, bool, bool]], Callable]:
+        # Record type -> (update, needs startDate, needs endDate); dates an aggregator
+        # doesn't declare arrive as None unparsed. Also returns the Workout update.
+        columns = self.columns
+        if columns is None:
+            dispatch = {
+                rtype: (agg.update, agg.needs_start, agg.needs_end) for rtype, agg in self.aggregators().items()
+            }
+            return dispatch, self.workouts.update
+        # Collecting parses every date so the cached rows serve any later metric
+        dispatch = {
+            rtype: (columns.recorder(rtype, agg.update), True, True)
+            for rtype, agg in self.aggregators().items()
+        }
+        return dispatch, columns.workout_recorder(self.workouts.add)
+
+    def _handler(
+        self, on_progress: Optional[Callable[[int, Dict[str, int]], None]] = None
+    ) -> tuple[Callable[[str, Dict[str, str]], None], Callable[[], "_RecordScan"]]:
+        # handle(tag, attrib) takes one element (other tags are ignored); done() stores
+        # the running counts back and sends the last progress report
+        dispatch, update_workouts = self._dispatch()
+        records_seen = self.records_seen
+        type_counts = self.type_counts
+
+        def handle(tag: str, attrib: Dict[str, str]) -> None:
+            nonlocal records_seen, dispatch, update_workouts
+            if tag == "Record":
+                records_seen += 1
+                if records_seen % PROGRESS_EVERY == 0:
+                    self.fold()
+                    if on_progress is not None:
+                        on_progress(records_seen, type_counts)
+                    if self.columns is not None and self.columns.nbytes() > COLUMN_CACHE_MAX_BYTES:
+                        # Too large to cache: drop the rows and finish as a plain scan
+                        self.columns = None
+                        dispatch, update_workouts = self._dispatch()
+
+                rtype = attrib.get("type")
+                if not rtype:
+                    return
+                type_counts[rtype] += 1
+
+                entry = dispatch.get(rtype)
+                if entry is None:
+                    return
+                update, needs_start, needs_end = entry
+                update(
+                    _parse_dt(attrib.get("startDate")) if needs_start else None,
+                    _parse_dt(attrib.get("endDate")) if needs_end else None,
+                    attrib.get("value"),
+                )
+
+            elif tag == "Workout":
+                update_workouts(attrib)
+
+        def done() -> "_RecordScan":
+            self.records_seen = records_seen
+            if on_progress is not None:
+                on_progress(records_seen, type_counts)
+            return self
+
+        return handle, done
+
+    def update(
+        self,
+        elements: Iterable[tuple[str, Dict[str, str]]],
+        on_progress: Optional[Callable[[int, Dict[str, int]], None]] = None,
+    ) -> "_RecordScan":
+        handle, done = self._handler(on_progress)
+        for tag, attrib in elements:
+            handle(tag, attrib)
+        return done()
+
+    def scan(
+        self,
+        xml_file: Union[str, IO[bytes]],
+        on_progress: Optional[Callable[[int, Dict[str, int]], None]] = None,
+    ) -> "_RecordScan":
+        if XML_BACKEND == "expat":
+            # pyexpat calls the handler itself for every start tag, skipping the
+            # per-chunk hand-off through a generator
+            handle, done = self._handler(on_progress)
+            _feed_expat(xml_file, handle)
+            return done()
+        elements = _iter_elements(xml_file, ("Record", "Workout"), record_types=self.aggregators())
+        return self.update(elements, on_progress)
+
+    def update_columns(self, columns: Dict[str, Dict[str, Any]]) -> "_RecordScan":
+        # Feeds columns loaded from the column cache instead of parsed elements, a slice
+        # of rows at a time so temporaries stay small next to the memory-mapped columns
+        for rtype, agg in self.aggregators().items():
+            if rtype in columns:
+                start, end, value = columns[rtype]["start"], columns[rtype]["end"], columns[rtype]["value"]
+                for i in range(0, len(start), COLUMN_SLICE):
+                    j = i + COLUMN_SLICE
+                    agg.update_columns(start[i:j], end[i:j], value[i:j])
+                self.records_seen += len(start)
+                self.type_counts[rtype] += len(start)
+        if "Workout" in columns:
+            kinds, minutes = columns["Workout"]["kind"], columns["Workout"]["minutes"]
+            for i in range(0, len(kinds), COLUMN_SLICE):
+                j = i + COLUMN_SLICE
+                self.workouts.update_columns(kinds[i:j], minutes[i:j])
+        return self
+
+    def merge(self, other: "_RecordScan") -> "_RecordScan":
+        for rtype, agg in self.aggregators().items():
+            agg.merge(other.aggregators()[rtype])
+        self.workouts.merge(other.workouts)
+        self.records_seen += other.records_seen
+        self.type_counts.update(other.type_counts)
+        if self.columns is not None:
+            # A range that gave up collecting leaves the merged columns incomplete
+            if other.columns is None:
+                self.columns = None
+            else:
+                self.columns.merge(other.columns)
+                if self.columns.nbytes() > COLUMN_CACHE_MAX_BYTES:
+                    self.columns = None
+        return self
+
+    def finalize(self) -> Dict[str, Any]:
+        return {
+            "steps": self.steps.finalize(),
+            "energy": self.energy.finalize(),
+            "heart": {"avg": self.heart_rate.finalize(), "rest": self.resting_heart_rate.finalize()},
+            "sleep": self.sleep.finalize(),
+            "mindful": self.mindful.finalize(),
+            "workouts": self.workouts.finalize(),
+        }
+
+
+def _scan_records_once(
+    xml_file: Union[str, IO[bytes]],
+    on_progress: Optional[Callable[[int, Dict[str, int]], None]] = None,
+) -> Dict[str, Any]:
+    return _RecordScan().scan(xml_file, on_progress).finalize()
+
+
+def _scan_ranges(
+    path: str, parts: int, spans: Optional[list[tuple[int, int]]] = None
+) -> list[tuple[int, int]]:
+    # Split the file (or only the given spans of it) into about `parts` byte ranges that
+    # each end just after a ">", so no tag the fast scan matches can straddle two ranges
+    if spans is None:
+        spans = [(0, os.path.getsize(path))]
+    total = sum(b - a for a, b in spans)
+    if total == 0:
+        return []
+    step = -(-total // parts)
+    ranges = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for a, b in spans:
+            while b - a > step:
+                cut = mm.find(b">", a + step, b)
+                if cut == -1:
+                    break
+                ranges.append((a, cut + 1))
+                a = cut + 1
+            ranges.append((a, b))
+    return [(a, b) for a, b in ranges if b > a]
+
+
+def _scan_range(
+    path: str, start: int, end: int, collect: bool = False, build_index: bool = False
+) -> tuple[_RecordScan, Optional[_RecordIndex]]:
+    # Runs in a scan worker: aggregates one byte range of the mapped file, noting where
+    # the scanned types lie when build_index is set
+    scan = _RecordScan(collect)
+    kinds = tuple(sorted(scan.aggregators()))
+    index = _RecordIndex((*kinds, "Workout")) if build_index else None
+    pattern = _fast_pattern(("Record", "Workout"), kinds)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return scan.update(_fast_matches(pattern, mm, start, end, index)), index
+
+
+def _scan_parallel(
+    path: str,
+    on_progress: Optional[Callable[[int, int, Dict[str, int]], None]] = None,
+    collect: bool = False,
+    digest: Optional[str] = None,
+) -> _RecordScan:
+    # Byte ranges are scanned with the fast matcher in separate processes (in this one
+    # with SCAN_PROCESSES at 1) and merged. With a digest, only the ranges its stored
+    # index lists are read, or the scan builds that index for next time.
+    # on_progress gets (bytes done, records seen, records per type) as ranges finish.
+    size = os.path.getsize(path)
+    spans, index = None, None
+    if digest:
+        spans, index = _index_lookup(digest, path, (*_RecordScan().aggregators(), "Workout"))
+    ranges = _scan_ranges(path, max(SCAN_PROCESSES, 1) * SCAN_RANGES_PER_PROCESS, spans)
+    total = sum(b - a for a, b in ranges)
+    scans: list[Optional[_RecordScan]] = [None] * len(ranges)
+    indexes: list[Optional[_RecordIndex]] = [None] * len(ranges)
+    done_bytes = 0
+    records_seen = 0
+    type_counts: Counter = Counter()
+
+    def finished(i: int, part: _RecordScan, part_index: Optional[_RecordIndex]) -> None:
+        nonlocal done_bytes, records_seen
+        scans[i], indexes[i] = part, part_index
+        done_bytes += ranges[i][1] - ranges[i][0]
+        records_seen += part.records_seen
+        type_counts.update(part.type_counts)
+        if on_progress is not None:
+            # Bytes the index lets the scan skip count as done
+            on_progress(done_bytes * size // total, records_seen, dict(type_counts))
+
+    build = index is not None
+    if SCAN_PROCESSES <= 1:
+        for i, (a, b) in enumerate(ranges):
+            finished(i, *_scan_range(path, a, b, collect, build))
+    else:
+        # A pool per scan: this usually runs inside an analysis worker process, which
+        # would otherwise block on exit joining idle scan processes
+        with ProcessPoolExecutor(
+            max_workers=SCAN_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = {
+                executor.submit(_scan_range, path, a, b, collect, build): i for i, (a, b) in enumerate(ranges)
+            }
+            for fut in as_completed(futures):
+                finished(futures[fut], *fut.result())
+
+    # Merge in file order so float sums don't depend on completion order
+    merged = _RecordScan(collect)
+    for part in scans:
+        merged.merge(part)
+    if index is not None:
+        for part_index in indexes:
+            index.merge(part_index)
+        _index_put(digest, path, index)
+    return merged
+
+
+def _pandas_metrics(parser: Parser, digest: Optional[str] = None) -> Dict[str, Any]:
+    # Steps
+    steps_total = 0
+    steps_avg = 0
+    steps_best_month = ""
+    steps_monthly: list[dict[str, Any]] = []
+    daily_step_days = 0
+
+    steps_df = _df_for(parser, "HKQuantityTypeIdentifierStepCount")
+    if steps_df is not None:
+        values = _values(steps_df)
+        steps_total = int(np.nansum(values))
+        if steps_total > 0:
+            days, daily = _rollup(*_day_values(steps_df["_sd"].to_numpy(), values))
+            daily_step_days = int(days.size) or 1
+            steps_avg = int(round(steps_total / daily_step_days))
+            months, monthly = _monthly(days, daily)
+            steps_monthly = [{"month": m, "value": int(v)} for m, v in zip(months, monthly)]
+            if months:
+                steps_best_month = months[int(np.argmax(monthly))]
+
+    # Active energy
+    energy_total = 0.0
+    energy_avg = 0
+    energy_df = _df_for(parser, "HKQuantityTypeIdentifierActiveEnergyBurned")
+    if energy_df is not None:
+        values = _values(energy_df)
+        energy_total = float(np.nansum(values))
+        if energy_total > 0:
+            days, _ = _rollup(*_day_values(energy_df["_sd"].to_numpy(), values))
+            energy_days = int(days.size) or (daily_step_days or 1)
+            energy_avg = int(round(energy_total / energy_days))
+
+    # Heart rate
+    hr_avg = 0
+    hr_df = _df_for(parser, "HKQuantityTypeIdentifierHeartRate")
+    if hr_df is not None:
+        there = _values(hr_df)
+        there = there[~np.isnan(there)]
+        if len(there):
+            hr_avg = int(round(there.mean()))
+
+    # Resting HR
+    rhr_avg = 0
+    rhr_df = _df_for(parser, "HKQuantityTypeIdentifierRestingHeartRate")
+    if rhr_df is not None:
+        there = _values(rhr_df)
+        there = there[~np.isnan(there)]
+        if len(there):
+            rhr_avg = int(round(there.mean()))
+
+    # Sleep
+    sleep_total_h = 0.0
+    sleep_avg_h = 0.0
+    sleep_best_month = ""
+    sleep_df = _df_for(parser, "HKCategoryTypeIdentifierSleepAnalysis", text=True)
+    if sleep_df is not None and not sleep_df.empty:
+        # Classify each distinct value once, then pick rows by category code
+        sleep_values = sleep_df["_value"].cat
+        kinds = sleep_values.categories
+        asleep_kinds = kinds.isin(_ASLEEP_VALUES) | kinds.astype(str).str.contains("Asleep", case=False)
+        # Missing values have code -1, which lands on the appended False
+        asleep = np.append(asleep_kinds, False)[sleep_values.codes.to_numpy()]
+        if asleep.any():
+            starts = sleep_df["_sd"].to_numpy()[asleep]
+            hours = _spans(sleep_df)[asleep] / 3600
+            sleep_total_h = float(np.nansum(hours))
+            if sleep_total_h > 0:
+                days, daily_sleep = _rollup(*_day_values(starts, hours))
+                sleep_days = int(days.size) or 1
+                sleep_avg_h = round(sleep_total_h / sleep_days, 2)
+                months, monthly_sleep = _monthly(days, daily_sleep)
+                if months:
+                    sleep_best_month = months[int(np.argmax(monthly_sleep))]
+
+    # Mindful
+    mindful_total_min = 0.0
+    mindful_sessions = 0
+    mindful_df = _df_for(parser, "HKCategoryTypeIdentifierMindfulSession")
+    if mindful_df is not None and not mindful_df.empty:
+        mindful_total_min = float(np.nansum(_spans(mindful_df) / 60))
+        mindful_sessions = int(mindful_df.shape[0])
+
+    need_steps = steps_total == 0
+    need_energy = energy_total == 0
+    need_hr = hr_avg == 0 and rhr_avg == 0
+    need_sleep = sleep_total_h == 0
+    need_mindful = mindful_total_min == 0
+
+    # Metrics the frames came back empty for come from the full scan, which also covers
+    # workouts; otherwise only the Workout elements are streamed.
+    if any([need_steps, need_energy, need_hr, need_sleep, need_mindful]):
+        scanned = _scan_records_once(str(parser.xml_file))
+        workouts = scanned["workouts"]
+
+        if need_steps:
+            steps_total = scanned["steps"]["total"]
+            steps_avg = scanned["steps"]["average"]
+            steps_best_month = scanned["steps"]["bestMonth"]
+            steps_monthly = scanned["steps"]["monthlyData"]
+
+        if need_energy:
+            energy_total = scanned["energy"]["total"]
+            energy_avg = scanned["energy"]["average"]
+
+        if need_hr:
+            hr_avg = scanned["heart"]["avg"]
+            rhr_avg = scanned["heart"]["rest"]
+
+        if need_sleep:
+            sleep_total_h = scanned["sleep"]["totalHours"]
+            sleep_avg_h = scanned["sleep"]["averageHours"]
+            sleep_best_month = scanned["sleep"]["bestMonth"]
+
+        if need_mindful:
+            mindful_total_min = scanned["mindful"]["total"]
+            mindful_sessions = scanned["mindful"]["sessions"]
+    else:
+        workouts = _scan_workouts(str(parser.xml_file), digest)
 
     return {
         "steps": {
-            "total": int(round(steps_total)),
-            "average": int(round(steps_total / steps_days)),
-            "bestMonth": best_steps_month,
-            "monthlyData": [{"month": m, "value": int(round(v))} for m, v in steps_monthly_sorted],
+            "total": steps_total,
+            "average": steps_avg,
+            "bestMonth": steps_best_month,
+            "monthlyData": steps_monthly,
         },
-        "energy": {
-            "total": float(energy_total),
-            "average": int(round(energy_total / energy_days)),
+        "energy": {"total": energy_total, "average": energy_avg},
+        "heart": {"avg": hr_avg, "rest": rhr_avg},
+        "sleep": {
+            "totalHours": sleep_total_h,
+            "averageHours": sleep_avg_h,
+            "bestMonth": sleep_best_month,
         },
-        "heart": {
-            "avg": int(round(hr_sum / hr_count)) if hr_count else 0,
-            "rest": int(round(rhr_sum / rhr_count)) if rhr_count else 0,
+        "mindful": {"total": mindful_total_min, "sessions": mindful_sessions},
+        "workouts": workouts,
+    }
+
+
+def _build_metrics(scanned: Dict[str, Any]) -> Dict[str, Any]:
+    steps_total = scanned["steps"]["total"]
+    steps_best_month = scanned["steps"]["bestMonth"]
+    wk_count = scanned["workouts"]["total"]
+
+    steps_km = round(steps_total * 0.0008, 1)  # ~0.8 m/step
+    fun_fact = f"You walked ~{steps_km} km – roughly a city-to-city trek!"
+
+    return {
+        "steps": {
+            "total": int(steps_total),
+            "average": int(scanned["steps"]["average"]),
+            "bestMonth": steps_best_month,  # plain "YYYY-MM"
+            "monthlyData": scanned["steps"]["monthlyData"],
+        },
+        "workouts": {
+            "total": int(wk_count),
+            "types": dict(scanned["workouts"]["types"]),
+            "totalMinutes": int(scanned["workouts"]["totalMinutes"]),
         },
         "sleep": {
-            "totalHours": round(sleep_total_hours, 2),
-            "averageHours": round(sleep_total_hours / sleep_nights, 2) if sleep_total_hours else 0.0,
-            "bestMonth": best_sleep_month,
+            "averageHours": float(scanned["sleep"]["averageHours"]),
+            "totalHours": round(float(scanned["sleep"]["totalHours"]), 2),
+            "bestMonth": scanned["sleep"]["bestMonth"],  # plain "YYYY-MM"
+        },
+        "heartRate": {
+            "average": int(scanned["heart"]["avg"]),
+            "resting": int(scanned["heart"]["rest"]),
+        },
+        "activeEnergy": {
+            "total": round(float(scanned["energy"]["total"]), 2),
+            "average": int(scanned["energy"]["average"]),
         },
-        "mindful": {
-            "total": round(minful := mindful_total_min, 2) if (minful := mindful_total_min) else 0.0,
-            "sessions": int(mindful_sessions),
+        "mindfulMinutes": {
+            "total": round(float(scanned["mindful"]["total"]), 2),
+            "sessions": int(scanned["mindful"]["sessions"]),
+        },
+        "insights": {
+            "topAchievement": (f"{steps_best_month} was your steps peak!") if steps_best_month else "",
+            "funFact": fun_fact,
+            "yearComparison": f"You completed {wk_count} workout{'s' if wk_count != 1 else ''}!",
         },
     }
 
 
+def _export_member(zf: zipfile.ZipFile) -> str:
+    names = zf.namelist()
+    for cand in ("apple_health_export/export.xml", "apple_health_export/Export.xml"):
+        if cand in names:
+            return cand
+    # Re-zipped exports may use a different top-level folder
+    for name in names:
+        if name.rsplit("/", 1)[-1].lower() == "export.xml":
+            return name
+    raise InvalidExport("export.xml not found in the uploaded archive")
+
+
+async def _save_upload(file: UploadFile, dest: Path) -> str:
+    # Copy in fixed-size chunks so an 800 MB export never sits in memory at once,
+    # hashing along the way for the result cache
+    digest = hashlib.sha256()
+    with dest.open("wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+
+def _cache_path(digest: str) -> Path:
+    # The engine is part of the key since the two can disagree on sparse exports
+    return CACHE_DIR / f"{digest}-{ENGINE}-v{CACHE_VERSION}.json"
+
+
+def _cache_get(digest: str) -> Optional[Dict[str, Any]]:
+    if CACHE_MAX_BYTES <= 0:
+        return None
+    path = _cache_path(digest)
+    try:
+        metrics = json.loads(path.read_text())
+        os.utime(path)  # mtime doubles as the LRU timestamp
+        return metrics
+    except (OSError, ValueError):
+        return None
+
+
+def _cache_put(digest: str, metrics: Dict[str, Any]) -> None:
+    if CACHE_MAX_BYTES <= 0:
+        return
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        path = _cache_path(digest)
+        tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        tmp.write_text(json.dumps(metrics))
+        os.replace(tmp, path)
+        _evict_cache(CACHE_DIR.glob("*.json"), CACHE_MAX_BYTES, path)
+    except OSError:
+        logger.warning("Could not write result cache entry for %s", digest, exc_info=True)
+
+
+def _evict_cache(entries: Iterable[Path], budget: int, keep: Path) -> None:
+    # Evict least recently used entries (files, or directories of files) until they fit
+    # the budget; `keep`, the entry just written, is never evicted
+    sized = []
+    for entry in entries:
+        size = sum(f.stat().st_size for f in entry.iterdir()) if entry.is_dir() else entry.stat().st_size
+        sized.append((entry.stat().st_mtime, size, entry))
+    sized.sort(key=lambda t: t[0])
+
+    total = sum(size for _, size, _ in sized)
+    for _, size, entry in sized:
+        if total <= budget:
+            break
+        if entry == keep:
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink(missing_ok=True)
+        total -= size
+
+
+def _columns_path(digest: str) -> Path:
+    return CACHE_DIR / f"{digest}-columns-v{COLUMNS_VERSION}"
+
+
+def _columns_get(digest: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    # Column name -> read-only memory-mapped array; text columns come back as categoricals
+    if not COLUMN_CACHE or COLUMN_CACHE_MAX_BYTES <= 0:
+        return None
+    path = _columns_path(digest)
+    try:
+        meta = json.loads((path / "meta.json").read_text())
+        columns: Dict[str, Dict[str, Any]] = {}
+        for rtype, info in meta["types"].items():
+            cols = {name: np.load(path / f"{rtype}.{name}.npy", mmap_mode="r") for name in info["columns"]}
+            for name, categories in info.get("categories", {}).items():
+                cols[name] = pd.Categorical.from_codes(cols[name], categories)
+            columns[rtype] = cols
+        os.utime(path)  # mtime doubles as the LRU timestamp
+        return columns
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _columns_put(digest: str, columns: _RecordColumns) -> None:
+    if not COLUMN_CACHE or columns.nbytes() > COLUMN_CACHE_MAX_BYTES:
+        return
+    path = _columns_path(digest)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        tmp.mkdir(parents=True)
+        types: Dict[str, Dict[str, Any]] = {}
+
+        def save(rtype: str, name: str, values: Any) -> None:
+            info = types.setdefault(rtype, {"columns": []})
+            if isinstance(values, list):
+                # Text is stored as int32 codes into categories in order of first appearance
+                codes, categories = pd.factorize(pd.Series(values, dtype=object))
+                info.setdefault("categories", {})[name] = [str(c) for c in categories]
+                values = codes.astype(np.int32)
+            np.save(tmp / f"{rtype}.{name}.npy", np.asarray(values))
+            info["columns"].append(name)
+
+        for rtype, (starts, ends, values) in columns.rows.items():
+            if starts:
+                save(rtype, "start", starts)
+                save(rtype, "end", ends)
+                save(rtype, "value", values)
+        if columns.workout_kinds:
+            save("Workout", "kind", columns.workout_kinds)
+            save("Workout", "minutes", columns.workout_minutes)
+        (tmp / "meta.json").write_text(json.dumps({"types": types}))
+
+        if not path.exists():
+            os.replace(tmp, path)
+        # Column directories end in their version number; ones still being written in .tmp
+        _evict_cache(CACHE_DIR.glob("*-columns-v*[0-9]"), COLUMN_CACHE_MAX_BYTES, path)
+    except OSError:
+        logger.warning("Could not write column cache entry for %s", digest, exc_info=True)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _index_path(digest: str) -> Path:
+    return CACHE_DIR / f"{digest}-index-v{INDEX_VERSION}.json"
+
+
+def _index_lookup(
+    digest: str, path: str, kinds: Collection[str]
+) -> tuple[Optional[list[tuple[int, int]]], Optional[_RecordIndex]]:
+    # The ranges holding every element of the given types when a stored index for this
+    # export covers them all, else an empty index for the scan to fill. Index files are
+    # small and share the metrics budget; with the cache off there is neither.
+    if CACHE_MAX_BYTES <= 0:
+        return None, None
+    index_path = _index_path(digest)
+    try:
+        saved = json.loads(index_path.read_text())
+        if saved["size"] == os.path.getsize(path) and set(kinds) <= set(saved["kinds"]):
+            os.utime(index_path)  # mtime doubles as the LRU timestamp
+            return _index_ranges(saved["ranges"], kinds), None
+    except (OSError, ValueError, KeyError):
+        pass
+    return None, _RecordIndex(kinds)
+
+
+def _index_put(digest: str, path: str, index: _RecordIndex) -> None:
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        index_path = _index_path(digest)
+        tmp = index_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        tmp.write_text(json.dumps({"size": os.path.getsize(path), "kinds": index.kinds, "ranges": index.ranges}))
+        os.replace(tmp, index_path)
+        _evict_cache(CACHE_DIR.glob("*.json"), CACHE_MAX_BYTES, index_path)
+    except OSError:
+        logger.warning("Could not write record index for %s", digest, exc_info=True)
+
+
+class _ProgressReporter:
+    # Publishes a job's progress snapshot, timing each phase and estimating the parse ETA
+    def __init__(self, progress: Optional[MutableMapping[str, Dict[str, Any]]], job_id: Optional[str]) -> None:
+        self.progress = progress
+        self.job_id = job_id
+        self.state = {**_QUEUED_PROGRESS, "recordTypes": {}, "phaseSeconds": {}}
+        self.phase_started = time.monotonic()
+
+    def __call__(self, phase: str, **fields: Any) -> None:
+        if self.progress is None or self.job_id is None:
+            return
+
+        now = time.monotonic()
+        if phase != self.state["phase"]:
+            if self.state["phase"] != "queued":
+                self.state["phaseSeconds"][self.state["phase"]] = round(now - self.phase_started, 2)
+            self.state["phase"] = phase
+            self.phase_started = now
+        self.state.update(fields)
+
+        parsed, total = self.state["bytesParsed"], self.state["bytesTotal"]
+        if phase == "parse" and parsed and total:
+            self.state["etaSeconds"] = round((now - self.phase_started) * (total - parsed) / parsed, 1)
+        elif phase != "parse":
+            self.state["etaSeconds"] = None
+
+        self.progress[self.job_id] = {
+            **self.state,
+            "recordTypes": dict(self.state["recordTypes"]),
+            "phaseSeconds": dict(self.state["phaseSeconds"]),
+        }
+
+
+def _analyze_export(
+    zip_path: str,
+    engine: str,
+    workdir: str,
+    progress: Optional[MutableMapping[str, Dict[str, Any]]] = None,
+    job_id: Optional[str] = None,
+    digest: Optional[str] = None,
+) -> Dict[str, Any]:
+    # Runs inside the worker pool; arguments and result must stay picklable.
+    # Phases follow the Upload page steps: unzip -> parse -> analyze -> generate.
+    report = _ProgressReporter(progress, job_id)
+    try:
+        report("unzip")
+        if engine == "pandas":
+            parser = Parser(export_file=zip_path, output_dir=workdir, overwrite=True)
+            report("analyze")
+            scanned = _pandas_metrics(parser, digest)
+        elif digest and (columns := _columns_get(digest)) is not None:
+            # Rows cached by an earlier scan of the same export; no XML is read
+            report("analyze")
+            scanned = _RecordScan().update_columns(columns).finalize()
+        else:
+            # Single streaming pass over export.xml feeds every metric, workouts included.
+            # The member is decompressed on the fly; nothing else in the archive is extracted.
+            collect = bool(digest) and COLUMN_CACHE and COLUMN_CACHE_MAX_BYTES > 0
+            indexed = bool(digest) and RECORD_INDEX and CACHE_MAX_BYTES > 0
+            with zipfile.ZipFile(zip_path) as zf:
+                info = zf.getinfo(_export_member(zf))
+                if SCAN_PROCESSES > 1 or indexed:
+                    # Byte ranges need a seekable file, so export.xml alone is extracted
+                    xml_path = os.path.join(workdir, "export.xml")
+                    with zf.open(info) as raw, open(xml_path, "wb") as out:
+                        shutil.copyfileobj(raw, out, FAST_CHUNK_SIZE)
+                    report("parse", bytesTotal=info.file_size)
+                    scan = _scan_parallel(
+                        xml_path,
+                        on_progress=lambda done, n, types: report(
+                            "parse",
+                            bytesParsed=done,
+                            bytesTotal=info.file_size,
+                            recordsSeen=n,
+                            recordTypes=types,
+                        ),
+                        collect=collect,
+                        digest=digest if indexed else None,
+                    )
+                else:
+                    report("parse", bytesTotal=info.file_size)
+                    with zf.open(info) as raw:
+                        xml_file = _CountingReader(raw)
+                        scan = _RecordScan(collect).scan(
+                            xml_file,
+                            on_progress=lambda n, types: report(
+                                "parse",
+                                bytesParsed=xml_file.count,
+                                bytesTotal=info.file_size,
+                                recordsSeen=n,
+                                recordTypes=dict(types),
+                            ),
+                        )
+            report("analyze")
+            scanned = scan.finalize()
+            if scan.columns is not None:
+                _columns_put(digest, scan.columns)
+        report("generate")
+        metrics = _build_metrics(scanned)
+        report("done")
+        return metrics
+    except zipfile.BadZipFile:
+        raise InvalidExport("The uploaded file is not a zip archive")
+
+
+@app.get("/health")
+async def health() -> Dict[str, Any]:
+    return {"status": "ok", "pending": _pending}
+
+
 @app.post("/parse")
 async def parse(file: UploadFile = File(...)) -> Dict[str, Any]:
-    with tempfile.TemporaryDirectory() as td:
-        zip_path = Path(td) / (file.filename or "export.zip")
-        zip_path.write_bytes(await file.read())
-
-        parser = Parser(export_file=str(zip_path), overwrite=True)
-
-        # Steps
-        steps_total = 0
-        steps_avg = 0
-        steps_best_month = ""
-        steps_monthly: list[dict[str, Any]] = []
-        daily_step_days = 0
-
-        steps_df = _df_for(parser, "HKQuantityTypeIdentifierStepCount")
-        if steps_df is not None:
-            steps_total = int(steps_df["_value_num"].fillna(0).sum())
-            if steps_total > 0:
-                daily = steps_df.groupby(_period_key(steps_df["_sd"], "D"))["_value_num"].sum()
-                daily_step_days = int(daily.size) or 1
-                steps_avg = int(round(steps_total / daily_step_days))
-                monthly = (
-                    steps_df.groupby(_period_key(steps_df["_sd"], "M"))["_value_num"].sum().sort_index()
-                )
-                steps_monthly = [{"month": str(p), "value": int(v)} for p, v in monthly.items()]
-                if not monthly.empty:
-                    steps_best_month = str(monthly.idxmax())
-
-        # Active energy
-        energy_total = 0.0
-        energy_avg = 0
-        energy_df = _df_for(parser, "HKQuantityTypeIdentifierActiveEnergyBurned")
-        if energy_df is not None:
-            energy_total = float(energy_df["_value_num"].fillna(0).sum())
-            if energy_total > 0:
-                energy_daily = energy_df.groupby(_period_key(energy_df["_sd"], "D"))["_value_num"].sum()
-                energy_days = int(energy_daily.size) or (daily_step_days or 1)
-                energy_avg = int(round(energy_total / energy_days))
-
-        # Heart rate
-        hr_avg = 0
-        hr_df = _df_for(parser, "HKQuantityTypeIdentifierHeartRate")
-        if hr_df is not None:
-            there = hr_df["_value_num"].dropna()
-            if len(there):
-                hr_avg = int(round(there.mean()))
-
-        # Resting HR
-        rhr_avg = 0
-        rhr_df = _df_for(parser, "HKQuantityTypeIdentifierRestingHeartRate")
-        if rhr_df is not None:
-            there = rhr_df["_value_num"].dropna()
-            if len(there):
-                rhr_avg = int(round(there.mean()))
-
-        # Sleep
-        sleep_total_h = 0.0
-        sleep_avg_h = 0.0
-        sleep_best_month = ""
-        sleep_df = _df_for(parser, "HKCategoryTypeIdentifierSleepAnalysis")
-        if sleep_df is not None and not sleep_df.empty:
-            asleep_values = {
-                "HKCategoryValueSleepAnalysisAsleep",
-                "HKCategoryValueSleepAnalysisAsleepCore",
-                "HKCategoryValueSleepAnalysisAsleepDeep",
-                "HKCategoryValueSleepAnalysisAsleepREM",
-                "HKCategoryValueSleepAnalysisAsleepUnspecified",
-                "1",
-            }
-            asleep = sleep_df["_value_raw"].isin(asleep_values) | sleep_df["_value_str"].str.contains(
-                "Asleep", case=False, na=False
-            )
-            sleep_asleep = sleep_df[asleep].copy()
-            if not sleep_asleep.empty:
-                sleep_asleep["hours"] = (
-                    (sleep_asleep["_ed"] - sleep_asleep["_sd"]).dt.total_seconds().div(3600).clip(lower=0)
-                )
-                sleep_total_h = float(sleep_asleep["hours"].sum())
-                if sleep_total_h > 0:
-                    sleep_days = int(sleep_asleep["_sd"].dt.tz_convert("UTC").dt.date.nunique()) or 1
-                    sleep_avg_h = round(sleep_total_h / sleep_days, 2)
-                    monthly_sleep = (
-                        sleep_asleep.groupby(_period_key(sleep_asleep["_sd"], "M"))["hours"].sum().sort_index()
-                    )
-                    if not monthly_sleep.empty:
-                        sleep_best_month = str(monthly_sleep.idxmax())
-
-        # Mindful
-        mindful_total_min = 0.0
-        mindful_sessions = 0
-        mindful_df = _df_for(parser, "HKCategoryTypeIdentifierMindfulSession")
-        if mindful_df is not None and not mindful_df.empty:
-            mindful_df["minutes"] = (
-                (mindful_df["_ed"] - mindful_df["_sd"]).dt.total_seconds().div(60).clip(lower=0)
-            )
-            mindful_total_min = float(mindful_df["minutes"].sum())
-            mindful_sessions = int(mindful_df.shape[0])
-
-        need_steps = steps_total == 0
-        need_energy = energy_total == 0
-        need_hr = hr_avg == 0 and rhr_avg == 0
-        need_sleep = sleep_total_h == 0
-        need_mindful = mindful_total_min == 0
-
-        if any([need_steps, need_energy, need_hr, need_sleep, need_mindful]):
-            scanned = _scan_records_once(parser.xml_file)
-
-            if need_steps:
-                steps_total = scanned["steps"]["total"]
-                steps_avg = scanned["steps"]["average"]
-                steps_best_month = scanned["steps"]["bestMonth"]
-                steps_monthly = scanned["steps"]["monthlyData"]
-
-            if need_energy:
-                energy_total = scanned["energy"]["total"]
-                energy_avg = scanned["energy"]["average"]
-
-            if need_hr:
-                hr_avg = scanned["heart"]["avg"]
-                rhr_avg = scanned["heart"]["rest"]
-
-            if need_sleep:
-                sleep_total_h = scanned["sleep"]["totalHours"]
-                sleep_avg_h = scanned["sleep"]["averageHours"]
-                sleep_best_month = scanned["sleep"]["bestMonth"]
-
-            if need_mindful:
-                mindful_total_min = scanned["mindful"]["total"]
-                mindful_sessions = scanned["mindful"]["sessions"]
-
-        # Workouts
-        root = ET.parse(parser.xml_file).getroot()
-        workout_nodes = root.findall(".//Workout")
-        wk_count = len(workout_nodes)
-        wk_types = Counter()
-        wk_total_minutes = 0.0
-        for w in workout_nodes:
-            kind = (w.attrib.get("workoutActivityType") or "Other").replace("HKWorkoutActivityType", "")
-            wk_types[kind] += 1
-            dur = w.attrib.get("duration")
-            unit = (w.attrib.get("durationUnit") or "").lower()
+    global _pending
+    if _pending >= MAX_PENDING:
+        raise HTTPException(status_code=503, detail="Too many exports in progress, try again shortly")
+
+    _pending += 1
+    try:
+        with tempfile.TemporaryDirectory() as td:
+            zip_path = Path(td) / (file.filename or "export.zip")
+            digest = await _save_upload(file, zip_path)
+
+            cached = _cache_get(digest)
+            if cached is not None:
+                return cached
+
+            loop = asyncio.get_running_loop()
+            executor = _get_executor()
             try:
-                d = float(dur) if dur is not None else 0.0
-                if unit in {"hr", "hour", "hours"}:
-                    d *= 60.0
-                wk_total_minutes += d
-            except ValueError:
-                pass
-
-        steps_km = round(steps_total * 0.0008, 1)  # ~0.8 m/step
-        fun_fact = f"You walked ~{steps_km} km – roughly a city-to-city trek!"
-
-        metrics = {
-            "steps": {
-                "total": int(steps_total),
-                "average": int(steps_avg),
-                "bestMonth": steps_best_month,  # plain "YYYY-MM"
-                "monthlyData": steps_monthly,
-            },
-            "workouts": {
-                "total": int(wk_count),
-                "types": dict(wk_types),
-                "totalMinutes": int(round(wk_total_minutes)),
-            },
-            "sleep": {
-                "averageHours": float(sleep_avg_h),
-                "totalHours": round(float(sleep_total_h), 2),
-                "bestMonth": sleep_best_month,  # plain "YYYY-MM"
-            },
-            "heartRate": {
-                "average": int(hr_avg),
-                "resting": int(rhr_avg),
-            },
-            "activeEnergy": {
-                "total": round(float(energy_total), 2),
-                "average": int(energy_avg),
-            },
-            "mindfulMinutes": {
-                "total": round(float(mindful_total_min), 2),
-                "sessions": int(mindful_sessions),
-            },
-            "insights": {
-                "topAchievement": (f"{steps_best_month} was your steps peak!") if steps_best_month else "",
-                "funFact": fun_fact,
-                "yearComparison": f"You completed {wk_count} workout{'s' if wk_count != 1 else ''}!",
-            },
-        }
-        return metrics
+                metrics = await loop.run_in_executor(
+                    executor, _analyze_export, str(zip_path), ENGINE, td, None, None, digest
+                )
+            except BrokenProcessPool:
+                logger.exception("Analysis worker died")
+                _discard_executor(executor)
+                raise HTTPException(status_code=500, detail=WORKER_DIED)
+            _cache_put(digest, metrics)
+            return metrics
+    except InvalidExport as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    finally:
+        _pending -= 1
+
+
+def _prune_jobs() -> None:
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for job_id in [k for k, j in _jobs.items() if j["finishedAt"] and j["finishedAt"] < cutoff]:
+        del _jobs[job_id]
+        _get_progress().pop(job_id, None)
+
+
+async def _run_job(job_id: str, zip_path: str, workdir: str, digest: str) -> None:
+    global _pending
+    job = _jobs[job_id]
+    executor = _get_executor()
+    try:
+        loop = asyncio.get_running_loop()
+        job["result"] = await loop.run_in_executor(
+            executor, _analyze_export, zip_path, ENGINE, workdir, _get_progress(), job_id, digest
+        )
+        job["status"] = "done"
+        _cache_put(digest, job["result"])
+        progress = _get_progress().get(job_id) or _QUEUED_PROGRESS
+        logger.info(
+            "Job %s done: %d records, phases %s", job_id, progress["recordsSeen"], progress["phaseSeconds"]
+        )
+    except InvalidExport as exc:
+        job["status"] = "error"
+        job["error"] = str(exc)
+    except BrokenProcessPool:
+        logger.exception("Job %s failed: analysis worker died", job_id)
+        _discard_executor(executor)
+        job["status"] = "error"
+        job["error"] = WORKER_DIED
+    except Exception:
+        logger.exception("Job %s failed", job_id)
+        job["status"] = "error"
+        job["error"] = "Failed to analyse the export"
+    finally:
+        job["finishedAt"] = time.time()
+        _pending -= 1
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(file: UploadFile = File(...)) -> Dict[str, Any]:
+    global _pending
+    _prune_jobs()
+    if _pending >= MAX_PENDING:
+        raise HTTPException(status_code=503, detail="Too many exports in progress, try again shortly")
+
+    _pending += 1
+    td = tempfile.mkdtemp()
+    try:
+        zip_path = Path(td) / "export.zip"
+        digest = await _save_upload(file, zip_path)
+        cached = _cache_get(digest)
+    except BaseException:
+        _pending -= 1
+        shutil.rmtree(td, ignore_errors=True)
+        raise
+
+    job_id = uuid.uuid4().hex
+    if cached is not None:
+        _pending -= 1
+        shutil.rmtree(td, ignore_errors=True)
+        _jobs[job_id] = {"status": "done", "result": cached, "error": None, "finishedAt": time.time()}
+        return {"id": job_id, "status": "done"}
+
+    _jobs[job_id] = {"status": "running", "result": None, "error": None, "finishedAt": None}
+    task = asyncio.create_task(_run_job(job_id, str(zip_path), td, digest))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    return {"id": job_id, "status": "running"}
+
+
+def _job_view(job_id: str, job: Dict[str, Any]) -> Dict[str, Any]:
+    progress = dict(_get_progress().get(job_id) or _QUEUED_PROGRESS)
+    phase = progress.pop("phase")
+    if job["status"] == "done":
+        phase = "done"
+    elif job["status"] == "error":
+        phase = "error"
+    return {
+        "id": job_id,
+        "status": job["status"],
+        "phase": phase,
+        "progress": progress,
+        "result": job["result"],
+        "error": job["error"],
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> Dict[str, Any]:
+    _prune_jobs()
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return _job_view(job_id, job)
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str) -> StreamingResponse:
+    # Server-sent events: "progress" whenever the snapshot changes, then a final
+    # "done" (with the result) or "failed" event before the stream closes.
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def stream():
+        last = None
+        while True:
+            view = _job_view(job_id, job)
+            if view["status"] == "done":
+                yield _sse("done", view)
+                return
+            if view["status"] == "error":
+                yield _sse("failed", view)
+                return
+            if view != last:
+                yield _sse("progress", view)
+                last = view
+            await asyncio.sleep(EVENTS_INTERVAL)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
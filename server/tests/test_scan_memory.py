@@ -0,0 +1,67 @@
+"""Bounded memory for the streaming scan.
+
+Each backend scans a synthetic 1M-record export in a fresh interpreter, so the peak
+RSS it reports belongs to that scan alone. Besides the full scan over interleaved
+records, a workouts-only scan runs over an export laid out like Apple's, with every
+Workout after the Records it must skip. Run from the server directory:
+``python -m pytest tests``
+"""
+
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+import bench  # noqa: E402
+import main  # noqa: E402
+
+RECORDS = 1_000_000
+# Most the scan may add to the peak RSS left by the imports. Holding every element of
+# a 1M-record export grows it by ~90 MiB (stdlib shells) to ~2.3 GiB (lxml elements);
+# the bounded scanners stay under ~10 MiB.
+SCAN_RSS_CEILING_MIB = 32
+
+_SCAN = """
+import resource, sys
+import main
+
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+getattr(main, sys.argv[1])(sys.argv[2])
+grown = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+print(grown // 2**20 if sys.platform == "darwin" else grown // 1024)  # bytes on macOS, KiB on Linux
+"""
+
+
+@pytest.fixture(scope="module")
+def exports(tmp_path_factory: pytest.TempPathFactory) -> dict[bool, Path]:
+    # grouped -> export.xml; grouped ones have each type in one run and Workouts last
+    paths = {}
+    for grouped in (False, True):
+        paths[grouped] = tmp_path_factory.mktemp("grouped" if grouped else "interleaved") / "export.xml"
+        bench.write_synthetic_export(str(paths[grouped]), RECORDS, grouped=grouped)
+    return paths
+
+
+@pytest.mark.parametrize("scan, grouped", [("_scan_records_once", False), ("_scan_workouts", True)])
+@pytest.mark.parametrize("backend", ["stdlib", "lxml", "expat"])
+def test_scan_stays_under_rss_ceiling(exports: dict[bool, Path], backend: str, scan: str, grouped: bool) -> None:
+    if backend == "lxml" and main.LET is None:
+        pytest.skip("lxml is not installed")
+    env = {**os.environ, "HEALTH_WRAPPED_XML_BACKEND": backend}
+    result = subprocess.run(
+        [sys.executable, "-c", _SCAN, scan, str(exports[grouped])],
+        cwd=SERVER_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    grown_mib = int(result.stdout)
+    assert grown_mib < SCAN_RSS_CEILING_MIB, f"{backend} {scan} grew peak RSS by {grown_mib} MiB"
@@ -37,20 +37,68 @@ export interface HealthMetrics {
 const API_URL =
   import.meta?.env?.VITE_HEALTH_API_URL?.replace(/\/$/, "") || "http://localhost:8000";
 
-export async function parseAppleHealthXML(file: File): Promise<HealthMetrics> {
+export type JobPhase = "queued" | "unzip" | "parse" | "analyze" | "generate" | "done" | "error";
+
+export interface JobStatus {
+  id: string;
+  status: "running" | "done" | "error";
+  phase: JobPhase;
+  progress: {
+    bytesParsed: number;
+    bytesTotal: number;
+    recordsSeen: number;
+    recordTypes: Record<string, number>;
+    etaSeconds: number | null;
+    phaseSeconds: Partial<Record<JobPhase, number>>;
+  };
+  result: HealthMetrics | null;
+  error: string | null;
+}
+
+export async function parseAppleHealthExport(
+  file: File,
+  onProgress?: (job: JobStatus) => void,
+): Promise<HealthMetrics> {
   const fd = new FormData();
   fd.append("file", file, file.name);
 
-  const res = await fetch(`${API_URL}/parse`, {
+  const res = await fetch(`${API_URL}/jobs`, {
     method: "POST",
     body: fd,
   });
 
   if (!res.ok) {
     const text = await res.text().catch(() => "");
-    throw new Error(`Backend parse failed (${res.status}): ${text || res.statusText}`);
+    throw new Error(`Backend upload failed (${res.status}): ${text || res.statusText}`);
   }
 
-  const data = (await res.json()) as HealthMetrics;
-  return data;
-}
\ No newline at end of file
+  const { id } = (await res.json()) as { id: string };
+
+  // Progress arrives as server-sent events until the job finishes
+  return new Promise<HealthMetrics>((resolve, reject) => {
+    const events = new EventSource(`${API_URL}/jobs/${id}/events`);
+
+    events.addEventListener("progress", e => {
+      onProgress?.(JSON.parse((e as MessageEvent).data) as JobStatus);
+    });
+
+    events.addEventListener("done", e => {
+      events.close();
+      const job = JSON.parse((e as MessageEvent).data) as JobStatus;
+      onProgress?.(job);
+      if (job.result) resolve(job.result);
+      else reject(new Error("Backend parse finished without a result"));
+    });
+
+    events.addEventListener("failed", e => {
+      events.close();
+      const job = JSON.parse((e as MessageEvent).data) as JobStatus;
+      reject(new Error(`Backend parse failed: ${job.error ?? "unknown error"}`));
+    });
+
+    events.onerror = () => {
+      events.close();
+      reject(new Error("Lost connection to the backend while parsing"));
+    };
+  });
+}
@@ -2,7 +2,7 @@ import { useState, useCallback } from "react";
 import { useNavigate } from "react-router-dom";
 import { Button } from "@/components/ui/button";
 import { Upload as UploadIcon, CheckCircle2, Loader2 } from "lucide-react";
-import { parseAppleHealthXML } from "@/lib/healthParser";
+import { parseAppleHealthExport, type JobPhase, type JobStatus } from "@/lib/healthParser";
 import { toast } from "sonner";
 
 type Step = "upload" | "unzip" | "parse" | "analyze" | "generate";
@@ -15,11 +15,28 @@ const steps: { id: Step; label: string }[] = [
   { id: "generate", label: "Generate" },
 ];
 
+// Backend job phases that correspond to a visible step
+const phaseSteps: Partial<Record<JobPhase, Step>> = {
+  unzip: "unzip",
+  parse: "parse",
+  analyze: "analyze",
+  generate: "generate",
+};
+
+const formatProgress = ({ progress }: JobStatus) => {
+  const mb = (bytes: number) => Math.round(bytes / 1e6).toLocaleString();
+  const parts = [`${mb(progress.bytesParsed)} of ${mb(progress.bytesTotal)} MB`];
+  parts.push(`${progress.recordsSeen.toLocaleString()} records`);
+  if (progress.etaSeconds !== null) parts.push(`~${Math.ceil(progress.etaSeconds)}s left`);
+  return parts.join(" · ");
+};
+
 const Upload = () => {
   const navigate = useNavigate();
   const [currentStep, setCurrentStep] = useState<Step>("upload");
   const [processing, setProcessing] = useState(false);
   const [file, setFile] = useState<File | null>(null);
+  const [job, setJob] = useState<JobStatus | null>(null);
 
   const handleFileChange = (e: React.ChangeEvent<HTMLInputElement>) => {
     const selectedFile = e.target.files?.[0];
@@ -38,20 +55,13 @@ const Upload = () => {
     setProcessing(true);
 
     try {
-      // Step 1: Unzip
-      setCurrentStep("unzip");
-      await new Promise(resolve => setTimeout(resolve, 800));
+      // Steps follow the phase reported by the backend job
+      const healthData = await parseAppleHealthExport(file, update => {
+        setJob(update);
+        const step = phaseSteps[update.phase];
+        if (step) setCurrentStep(step);
+      });
 
-      // Step 2: Parse
-      setCurrentStep("parse");
-      const healthData = await parseAppleHealthXML(file);
-      await new Promise(resolve => setTimeout(resolve, 800));
-
-      // Step 3: Analyze
-      setCurrentStep("analyze");
-      await new Promise(resolve => setTimeout(resolve, 1000));
-
-      // Step 4: Generate
       setCurrentStep("generate");
       await new Promise(resolve => setTimeout(resolve, 800));
 
@@ -61,6 +71,7 @@ const Upload = () => {
       console.error("Error processing health data:", error);
       toast.error("Failed to process health data. Please ensure you uploaded a valid Apple Health export.");
       setProcessing(false);
+      setJob(null);
       setCurrentStep("upload");
     }
   }, [file, navigate]);
@@ -130,6 +141,10 @@ const Upload = () => {
                 );
               })}
             </div>
+
+            {job && job.phase === "parse" && job.progress.bytesTotal > 0 && (
+              <p className="text-center text-white/80 text-sm mt-8">{formatProgress(job)}</p>
+            )}
           </div>
         )}
 